@@ -0,0 +1,114 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from pygu import pyslim
+
+
+def make_flac(path):
+    '''
+    Write a FLAC file with an empty Vorbis comment to @path.
+    '''
+    info = (struct.pack('>HH', 4096, 4096) + b'\0' * 6 + 
+            b'\x0a\xc4\x42\xf0' + b'\0' * 20)
+    comment = struct.pack('<I', 4) + b'test' + struct.pack('<I', 0)
+    with open(path, 'wb') as f:
+        f.write(b'fLaC')
+        f.write(b'\x00' + struct.pack('>I', len(info))[1:] + info)
+        f.write(b'\x84' + struct.pack('>I', len(comment))[1:] + comment)
+        f.write(b'\xff\xf8' + b'\0' * 100)
+
+
+def make_mp3(path):
+    '''
+    Write an untagged MP3 file of silent frames to @path.
+    '''
+    with open(path, 'wb') as f:
+        f.write((b'\xff\xfb\x90\x00' + b'\0' * 413) * 20)
+
+
+class LoaderTest(object):
+    '''
+    Round trips through one loader; mixed into the TestCase()s below.
+    '''
+    loader = None
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.flac = os.path.join(self.dir, 'a.flac')
+        self.mp3 = os.path.join(self.dir, 'a.mp3')
+        make_flac(self.flac)
+        make_mp3(self.mp3)
+    
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+    
+    def check_round_trip(self, filename):
+        obj = self.loader(filename)
+        obj['gstart'] = '2.5'
+        obj['gtype'] = '2'
+        obj.save()
+        self.assertEqual(pyslim.read_tags(filename, ['gstart', 'gtype']), 
+                {'gstart': ['2.5'], 'gtype': ['2']})
+        obj = self.loader(filename)
+        self.assertTrue('gstart' in obj)
+        del obj['gstart']
+        obj.save()
+        self.assertEqual(pyslim.read_tags(filename, ['gstart', 'gtype']), 
+                {'gtype': ['2']})
+    
+    def test_flac(self):
+        self.check_round_trip(self.flac)
+    
+    def test_mp3(self):
+        self.check_round_trip(self.mp3)
+
+
+@unittest.skipUnless(pyslim._is_available('mutagen'), 
+        'mutagen is not installed')
+class MutagenTest(LoaderTest, unittest.TestCase):
+    loader = pyslim.MutagenLoader
+    
+    def test_save_many(self):
+        res = pyslim.save_many({self.flac: {'gstart': '1.5'}, 
+                self.mp3: {'gstart': '1.5'}})
+        self.assertEqual(res, {self.flac: None, self.mp3: None})
+        for fl in (self.flac, self.mp3):
+            self.assertEqual(pyslim.load(fl).get('gstart'), ['1.5'])
+
+
+@unittest.skipUnless(pyslim._is_available('tagpy'), 'tagpy is not installed')
+class TagPyTest(LoaderTest, unittest.TestCase):
+    loader = pyslim.TagPyLoader
+    
+    def test_common_fields(self):
+        obj = self.loader(self.flac)
+        obj['title'] = 'Title'
+        obj['track'] = 3
+        obj.save()
+        obj = self.loader(self.flac)
+        self.assertEqual((obj['title'], obj['track']), ('Title', 3))
+
+
+@unittest.skipUnless(pyslim.ldict, 'no loaders are installed')
+class BenchmarkTest(unittest.TestCase):
+    def test_keeps_keys(self):
+        d = tempfile.mkdtemp()
+        try:
+            flac = os.path.join(d, 'a.flac')
+            make_flac(flac)
+            pyslim.save_many({flac: {'gstart': '1'}})
+            keys = set(pyslim.load(flac).keys())
+            chosen = pyslim.benchmark([flac])
+            self.assertEqual(set(pyslim.load(flac).keys()), keys)
+            self.assertEqual(pyslim.benchmark([flac]), {})
+            for cls in chosen.values():
+                self.assertTrue(cls.writable)
+        finally:
+            shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,24 @@
 '''
 Shared information, classes and functions for PyGU.
 '''
+import weakref as _weakref
 from pgpu.math_utils import Vector as _vec
 from os.path import extsep as _extsep
 
 
+class _Stop(object):
+    def __repr__(self):
+        return 'STOP'
+
+# Returned by event handlers and hotspots that consume the event.
+STOP = _Stop()
+
+
 def get_ext(fl):
-    return fl.split(_extsep)[-1]
+    '''
+    Get the extension of filename @fl, in lowercase.
+    '''
+    return fl.split(_extsep)[-1].lower()
 
 
 def _blitter(loc, target, source, dest, area, special_flags):
@@ -39,3 +51,44 @@ def hcenter_blit(target, source, dest = (0, 0), area=None, special_flags=0):
     loc = lambda d, s: (_vec(d.get_width() / 2, 0) - 
             _vec(s.get_width() / 2, 0))
     _blitter(loc, target, source, dest, area, special_flags)
+
+
+class WeakCallable(object):
+    '''
+    Wraps around a callable without keeping the object of a bound method 
+    alive. Once the object is gone, calling returns None, and @callback, if 
+    given, is called with the WeakCallable(). Other callables are held 
+    normally, as nothing else may be referring to them.
+    '''
+    def __init__(self, func, callback=None):
+        obj = getattr(func, '__self__', None)
+        self.func = getattr(func, '__func__', None)
+        if obj is None or self.func is None:
+            self.func = func
+            self.ref = None
+        elif callback is None:
+            self.ref = _weakref.ref(obj)
+        else:
+            self.ref = _weakref.ref(obj, lambda r: callback(self))
+    
+    def __call__(self, *args, **kw):
+        if self.ref is None:
+            return self.func(*args, **kw)
+        obj = self.ref()
+        if obj is not None:
+            return self.func(obj, *args, **kw)
+    
+    def alive(self):
+        '''
+        Check whether the wrapped callable can still be called.
+        '''
+        return self.ref is None or self.ref() is not None
+
+
+def weak_callable(func, callback=None):
+    '''
+    Wrap @func in a WeakCallable(), unless it is None or already wrapped.
+    '''
+    if func is None or isinstance(func, WeakCallable):
+        return func
+    return WeakCallable(func, callback)
@@ -19,9 +19,19 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import os
+import sys
+import json
 import random
+from array import array
+from collections import deque
 
-__version__ = '1.2.2'
+try:
+    intern
+except NameError:
+    from sys import intern
+
+__version__ = '1.3.0'
 
 class Playlist(object):
     '''
@@ -49,78 +59,245 @@ class Playlist(object):
     This means that 'group8/music2' could be an intro for an unlimited loop of 
     'group8/music3' and 'group8/music4'.Also note the *2*: this tells the 
     playlist to give a double chance of selecting to this metasong when shuffle 
-    is on. This value must be a positive integer, be at the beginning of a 
-    metasong, and be between two asterisks.
+    is on. This value must be a positive number, be at the beginning of a 
+    metasong, and be between two asterisks. Since v1.3, it may have a 
+    fractional part, as in *0.25*.
+    
+    This implementation supports v1.3 weighted shuffling and folder hints. 
+    Weighted picks take constant time however large the weights are, as they 
+    use Vose's alias method.
     
-    This implementation supports v1.2 weighted shuffling and folder hints.
+    Playlists are parsed line by line into a compact form: `.tracks` holds 
+    each distinct (group, title) tuple once, `.array` holds the track ids of 
+    all metasongs, and `.offsets` holds where the intro and the body of each 
+    metasong start in it. See load() for caching that form on disk.
+    
+    Tracks are handed out as (group, title) tuples, unless the playlist has 
+    been bound to the player's own records of them with resolve().
     '''
     
     perrm = 'The parser encountered an error while parsing line %s!'
     
-    def __init__(self, lines, shuffle=False, strict=True):
+    def __init__(self, lines, shuffle=False, strict=True, no_repeat=0, 
+            compiled=None):
+        '''
+        @lines is an iterable of the PMS lines to load, such as a list or an 
+        open file. @shuffle, which may be changed later using the `.shuffle` 
+        attribute, determines whether to shuffle the metasongs. @strict 
+        determines whether erroneous lines should raise an error or simply be 
+        ignored. When shuffling, none of the last @no_repeat metasongs will be 
+        picked again, as far as there are enough metasongs. If @compiled, as 
+        from get_compiled(), is given, @lines and @strict are ignored.
+        '''
+        if compiled is None:
+            compiled = self._parse(lines, strict)
+        (self.folders, self.tracks, self.start, self.array, self.offsets, 
+                self.weights) = compiled
+        # What gets handed out for each track id; see resolve()
+        self.records = self.tracks
+        
+        self.shuffle = shuffle
+        self.strict = strict
+        self.pos = 0
+        self.at_beginning = False
+        self.song = 0
+        
+        self._set_no_repeat(no_repeat)
+        self._gen_shuffles()
+    
+    def _set_no_repeat(self, no_repeat):
+        '''
+        Used internally to set up the window of recent metasongs.
+        '''
+        # Cannot avoid more metasongs than all but one
+        self.no_repeat = max(0, min(no_repeat, len(self.weights) - 1))
+        self.recent = deque(maxlen=self.no_repeat or None)
+    
+    def _parse(self, lines, strict):
         '''
-        @lines is a list of the PMS lines to load. @shuffle, which may be 
-        changed later using the `.shuffle` attribute, determines whether to 
-        shuffle the metasongs. @strict determines whether erroneous lines 
-        should raise an error or simply be ignored.
+        Used internally to compile @lines. See get_compiled() for the result.
         '''
-        self.folders = lines[0].split(';') if lines else []
+        ids = {}
+        tracks = []
+        def parse_part(part):
+            # Turn 'group1/music1.group2/music2' into track ids.
+            res = []
+            for m in part.split('.'):
+                group, slash, title = m.partition('/')
+                if not (group and slash and title) or '/' in title:
+                    raise ValueError
+                key = (group, title)
+                if key not in ids:
+                    ids[key] = len(tracks)
+                    tracks.append((intern(group), intern(title)))
+                res.append(ids[key])
+            return res
+        
+        lines = iter(lines)
+        folders = next(lines, '').strip()
+        folders = folders.split(';') if folders else []
         try:
-            self.start = ([m.split('/') for m in lines[1].split('.')] if 
-                    lines[1] else [])
-        except:
+            line = next(lines, '').strip()
+            start = tuple(parse_part(line)) if line else ()
+        except ValueError:
             if strict:
                 raise ValueError(self.perrm % 1)
-            self.start = []
+            start = ()
         
-        self.loop = []
+        songs = array('i')
+        offsets = array('i', [0])
+        weights = array('d')
         lcount = 1
         
-        for line in lines[2:]:
+        for line in lines:
             lcount += 1
+            line = line.strip()
+            if not line:
+                continue
             try:
-                if not line:
-                    continue
                 ul = line
                 
-                # Shuffle weight: new to version 1.2
+                # Shuffle weight: new to version 1.2, fractions to 1.3
                 chance = 1      # default shuffle weight is 1
                 # if there is a specified shuffle weight, use it!
                 if ul.startswith('*'):
                     e = ul[1:].find('*') + 1
-                    chance = int(ul[1:e])
+                    chance = float(ul[1:e])
+                    if not chance > 0:
+                        raise ValueError
                     # We don't want to try to parse the weight!
                     ul = ul[e + 1:]
-                song = [[m.split('/') for m in group.split('.')] 
-                        for group in ul.split('^', 2)]
-            except:
+                parts = ul.split('^')
+                if len(parts) > 2:
+                    raise ValueError
+                intro = parse_part(parts[0]) if len(parts) == 2 else []
+                body = parse_part(parts[-1])
+            except ValueError:
                 if strict:
                     raise ValueError(self.perrm % lcount)
                 continue
-            self.loop.append((song, chance))
+            songs.extend(intro)
+            offsets.append(len(songs))
+            songs.extend(body)
+            offsets.append(len(songs))
+            weights.append(chance)
         
-        self.shuffle = shuffle
-        self.pos = 0
-        self.at_beginning = False
-        self.song = 0
+        return folders, tracks, start, songs, offsets, weights
+    
+    def get_compiled(self):
+        '''
+        Get the compiled form of the playlist: a (folders, tracks, start, 
+        array, offsets, weights) tuple. `tracks` is a list of (group, title) 
+        tuples, and `start` a tuple of indices into it. The intro of metasong 
+        i is array[offsets[2 * i]:offsets[2 * i + 1]], and its body follows 
+        until offsets[2 * i + 2]. `weights` holds the shuffle weights.
+        '''
+        return (self.folders, self.tracks, self.start, self.array, 
+                self.offsets, self.weights)
+    
+    def resolve(self, lookup, strict=None):
+        '''
+        Bind each track to the record `lookup(group, title)` returns for it, 
+        so that the records are handed out from then on. @lookup should raise 
+        a KeyError for unknown tracks. If @strict (by default, the @strict 
+        given when parsing) is true, unknown tracks raise a ValueError; 
+        otherwise, they are left out, along with metasongs left without a 
+        body. Returns the list of unknown (group, title) tuples.
+        '''
+        if strict is None:
+            strict = self.strict
+        records = []
+        missing = []
+        for track in self.tracks:
+            try:
+                records.append(lookup(*track))
+            except KeyError:
+                records.append(None)
+                missing.append(track)
         
+        if missing and strict:
+            raise ValueError('Unknown tracks in playlist: %s' % 
+                    ', '.join('/'.join(t) for t in missing))
+        if missing:
+            self._strip(records)
+        self.records = records
+        return missing
+    
+    def _strip(self, records):
+        '''
+        Used internally to leave out tracks whose records are None.
+        '''
+        self.start = tuple(i for i in self.start if records[i] is not None)
+        songs = array('i')
+        offsets = array('i', [0])
+        weights = array('d')
+        for song, weight in enumerate(self.weights):
+            intro, first, end = self.offsets[song * 2:song * 2 + 3]
+            body = [i for i in self.array[first:end] if records[i] is not None]
+            if not body:
+                continue
+            songs.extend(i for i in self.array[intro:first] 
+                    if records[i] is not None)
+            offsets.append(len(songs))
+            songs.extend(body)
+            offsets.append(len(songs))
+            weights.append(weight)
+        self.array, self.offsets, self.weights = songs, offsets, weights
+        
+        self.song = 0
+        self._set_no_repeat(self.no_repeat)
         self._gen_shuffles()
     
     def _gen_shuffles(self):
         '''
-        Used internally to build a list for mapping between a random number and 
-        a song index.
+        Used internally to build the tables of Vose's alias method, which map 
+        a random number to a metasong index in constant time.
         '''
-        # The current metasong index 
-        si = 0
-        # The shuffle mapper list
-        self.shuffles = []
-        # Go through all our songs...
-        for song in self.loop:
-            # And add them to the list as many times as they say to.
-            for i in range(song[1]):
-                self.shuffles.append(si)
-            si += 1
+        n = len(self.weights)
+        total = float(sum(self.weights))
+        # Scale the weights so that they average 1
+        scaled = [w * n / total for w in self.weights]
+        # The chance of keeping a column, and the metasong filling the rest
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            l = small.pop()
+            g = large.pop()
+            self.prob[l] = scaled[l]
+            self.alias[l] = g
+            # Whatever g gave to fill up l's column is taken from g
+            scaled[g] += scaled[l] - 1
+            (small if scaled[g] < 1 else large).append(g)
+        # Anything left over is 1 but for rounding errors.
+    
+    def _pick(self):
+        '''
+        Used internally to pick a random metasong index, accounting for 
+        weighting.
+        '''
+        i = random.randrange(len(self.prob))
+        return i if random.random() < self.prob[i] else self.alias[i]
+    
+    def _pick_fresh(self):
+        '''
+        Used internally to pick a random metasong index, accounting for 
+        weighting and leaving out the recent ones.
+        '''
+        # Usually right the first few times...
+        for i in range(16):
+            song = self._pick()
+            if song not in self.recent:
+                return song
+        # But the recent metasongs may hog the weight.
+        songs = [i for i in range(len(self.weights)) if i not in self.recent]
+        x = random.random() * sum(self.weights[i] for i in songs)
+        for song in songs:
+            x -= self.weights[song]
+            if x < 0:
+                break
+        return song
     
     def _new_song(self):
         '''
@@ -131,13 +308,17 @@ class Playlist(object):
         
         if self.shuffle:
             # If shuffle is on, we need to (1) get a random song that 
-            # (2) accounts for weighting. This line does both.
-            self.song = self.shuffles[random.randrange(len(self.shuffles))]
+            # (2) accounts for weighting. These lines do both.
+            if self.no_repeat:
+                self.song = self._pick_fresh()
+                self.recent.append(self.song)
+            else:
+                self.song = self._pick()
         else:
             # Nice and easy, just get the next song...
             self.song += 1
             # But wait! need to make sure it exists!
-            if self.song >= len(self.loop):
+            if self.song >= len(self.weights):
                 # It doesn't, so start over at the beginning.
                 self.song = 0
         # Set flag if we have the same song as we had before.
@@ -147,20 +328,20 @@ class Playlist(object):
     
     def _get_selectable(self):
         '''
-        Used internally to get a group of choosable tracks.
+        Used internally to get the (first, end) range of choosable tracks in 
+        `.array`.
         '''
         # Save some typing
-        cursong = self.loop[self.song][0]
+        i = self.song * 2
+        intro, body, end = self.offsets[i:i + 3]
         
-        if self.dif_song and len(cursong) > 1:
+        if self.dif_song:
             # Position is relative to the intro of the track,
             # so we we will get the both the intro and body.
-            s = cursong[0] + cursong[1]
+            return intro, end
         else:
             # Position is relative to the body of the track, so just get that.
-            s = cursong[-1]
-        # Return what we found
-        return s
+            return body, end
     
     def _get_song(self):
         '''
@@ -171,23 +352,23 @@ class Playlist(object):
             # Make sure it exists.
             if self.pos < len(self.start):
                 # It exists, so return it.
-                return self.start[self.pos]
+                return self.records[self.start[self.pos]]
             # It doesn't exist, so let's move on!
             self.at_beginning = False
             # Generate a new track selection
-            self._new_track()
+            self._new_song()
         # A bit more difficult than using the start metasong, 
         # because we could have a beginning part. Call a function that gets all 
         # applicable tracks from the metasong.
-        s = self._get_selectable()
+        first, end = self._get_selectable()
         # Make sure it is long enough
-        while self.pos >= len(s):
+        while first + self.pos >= end:
             # Or pick a new metasong.
             self._new_song()
             # And repeat.
-            s = self._get_selectable()
+            first, end = self._get_selectable()
         # Found a track, return it.
-        return s[self.pos]
+        return self.records[self.array[first + self.pos]]
     
     def begin(self):
         '''
@@ -219,3 +400,67 @@ class Playlist(object):
         '''
         self._new_song()
         return self._get_song()
+
+
+def _read_cache(f, key):
+    '''
+    Used internally to read a compiled playlist from cache file @f, or return 
+    None if it wasn't made for @key. The cache is a line of JSON, followed by 
+    the raw contents of the arrays; it is never run as code.
+    '''
+    header = json.loads(f.readline().decode('utf-8'))
+    if header['key'] != key:
+        return None
+    arrays = []
+    for typecode, n in zip('iid', header['sizes']):
+        a = array(typecode)
+        a.fromfile(f, n)
+        arrays.append(a)
+    tracks = [tuple(t) for t in header['tracks']]
+    return (header['folders'], tracks, tuple(header['start'])) + tuple(arrays)
+
+
+def _write_cache(f, key, compiled):
+    '''
+    Used internally to write @compiled to cache file @f, for @key.
+    '''
+    folders, tracks, start, songs, offsets, weights = compiled
+    header = {'key': key, 'folders': folders, 'tracks': tracks, 
+            'start': start, 'sizes': [len(songs), len(offsets), len(weights)]}
+    f.write((json.dumps(header) + '\n').encode('utf-8'))
+    for a in (songs, offsets, weights):
+        a.tofile(f)
+
+
+def load(path, shuffle=False, strict=True, no_repeat=0, cache=False):
+    '''
+    Load a Playlist() from the file at @path; see Playlist() for the other 
+    arguments. With @cache, the compiled playlist is kept in a '.pmsc' file 
+    next to it, and read from there while the playlist is unchanged.
+    '''
+    kw = {'shuffle': shuffle, 'strict': strict, 'no_repeat': no_repeat}
+    if not cache:
+        with open(path) as f:
+            return Playlist(f, **kw)
+    
+    st = os.stat(path)
+    # The arrays are stored in the machine's byte order.
+    key = [__version__, st.st_mtime, st.st_size, bool(strict), sys.byteorder]
+    cpath = path + 'c'
+    try:
+        with open(cpath, 'rb') as f:
+            compiled = _read_cache(f, key)
+        if compiled is not None:
+            return Playlist(None, compiled=compiled, **kw)
+    except Exception:
+        # Missing, stale or broken; just parse the playlist.
+        pass
+    
+    with open(path) as f:
+        plist = Playlist(f, **kw)
+    try:
+        with open(cpath, 'wb') as f:
+            _write_cache(f, key, plist.get_compiled())
+    except (IOError, OSError):
+        pass
+    return plist
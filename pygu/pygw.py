@@ -23,14 +23,29 @@ __version__ = '2.0'
 
 import string
 import itertools
+import bisect
+import weakref
+from collections import OrderedDict
 from pgpu.math_utils import Vector, limit
 
-from common import vcenter_blit
+from common import vcenter_blit, weak_callable, STOP
 
 import pygame
 from pygame.locals import *
 
 
+def _blit_all(surf, seq):
+    '''
+    Blit each (source, dest) pair in @seq onto @surf, in one call if the 
+    installed Pygame supports Surface.blits().
+    '''
+    for source, dest in seq:
+        surf.blit(source, dest)
+
+if hasattr(pygame.Surface, 'blits'):
+    _blit_all = lambda surf, seq: surf.blits(seq, False)
+
+
 def is_container(c):
     '''
     Utility function to check for containerhood.
@@ -45,6 +60,122 @@ def is_widget(w):
     return getattr(w, '_iswidget', False) or isinstance(w, Widget)
 
 
+def is_skin(s):
+    '''
+    Utility function to check for skinniness.
+    '''
+    return getattr(s, '_isskin', False) or isinstance(s, NineSlice)
+
+
+class SkinCache(object):
+    '''
+    A least-recently-used cache for the Surface()s generated by skins, keyed 
+    by (skin, size, state). Once more than @maxsize Surface()s are held, the 
+    one that has gone unused the longest is dropped.
+    '''
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def get(self, key, make):
+        '''
+        Get the Surface() for @key, calling @make() to create it if needed.
+        '''
+        try:
+            surf = self._items.pop(key)
+        except KeyError:
+            surf = make()
+            while len(self._items) >= self.maxsize:
+                self._items.popitem(False)
+        # Reinserting marks the entry as the most recently used.
+        self._items[key] = surf
+        return surf
+    
+    def clear(self):
+        '''
+        Drop all of the cached Surface()s.
+        '''
+        self._items.clear()
+    
+    def get_cache_size(self):
+        '''
+        Get the number of bytes used by the cached Surface()s.
+        '''
+        return sum(s.get_pitch() * s.get_height() 
+                for s in self._items.values())
+
+skin_cache = SkinCache()
+
+
+class NineSlice(object):
+    '''
+    A skin that builds widget backgrounds of any size from one source image. 
+    The source is cut into nine pieces by @border; the corners are kept as 
+    they are, the edges are stretched along their length, and the center is 
+    stretched both ways.
+    
+    Skins can be used in place of the content Surface() of any widget, along 
+    with a size for the widget. Generated Surface()s are kept in a SkinCache().
+    '''
+    _isskin = True
+    
+    def __init__(self, source, border, active=None, cache=None):
+        '''
+        @source is the Surface() for the normal state;
+        @border is the width of the (left, top, right, bottom) edges, or a 
+         single width for all of them;
+        @active is the Surface() for the active (e.g. hovered) state, laid out 
+         the same as @source (Defaults to @source);
+        @cache is the SkinCache() to use (Defaults to the module's skin_cache).
+        '''
+        if isinstance(border, int):
+            border = (border,) * 4
+        self.border = tuple(border)
+        self.states = {'normal': source, 'active': active or source}
+        self.cache = skin_cache if cache is None else cache
+    
+    def get(self, size=None, state='normal'):
+        '''
+        Get a Surface() of @size for @state, which defaults to the size of the 
+        source.
+        '''
+        if size is None:
+            size = self.states[state].get_size()
+        size = tuple(size)
+        return self.cache.get((self, size, state), 
+                lambda: self._build(self.states[state], size))
+    
+    def _build(self, source, size):
+        '''
+        Used internally to build a Surface() of @size from @source.
+        '''
+        left, top, right, bottom = self.border
+        sw, sh = source.get_size()
+        w, h = size
+        xs = [(0, 0, left), (left, left, sw - left - right), 
+                (sw - right, w - right, right)]
+        ys = [(0, 0, top), (top, top, sh - top - bottom), 
+                (sh - bottom, h - bottom, bottom)]
+        mid_w = max(0, w - left - right)
+        mid_h = max(0, h - top - bottom)
+        
+        surf = pygame.Surface(size, source.get_flags(), source)
+        for i, (sx, dx, slen) in enumerate(xs):
+            dw = mid_w if i == 1 else slen
+            for j, (sy, dy, sheight) in enumerate(ys):
+                dh = mid_h if j == 1 else sheight
+                if slen <= 0 or sheight <= 0 or dw <= 0 or dh <= 0:
+                    continue
+                piece = source.subsurface((sx, sy, slen, sheight))
+                if (dw, dh) != (slen, sheight):
+                    piece = pygame.transform.scale(piece, (dw, dh))
+                surf.blit(piece, (dx, dy))
+        return surf
+
+
 class Base(object):
     '''
     Implements the core for both containers and widgets.
@@ -53,6 +184,7 @@ class Base(object):
     
     def __init__(self, container):
         self.container = None
+        self._hotspots = []
         
         if is_container(container):
             # Can't add to EventManager()s!
@@ -69,10 +201,59 @@ class Base(object):
         '''
         pass
     
+    def schedule(self):
+        '''
+        Ask for update() to be called during the next update() of the 
+        containers. Widgets call this whenever their state changes in a way 
+        that their image needs to reflect.
+        '''
+        if is_container(self.container):
+            self.container._schedule(self)
+    
+    def changed(self):
+        '''
+        Notify the containers that the class looks different now. Widgets 
+        must call this whenever they change their image, or cached 
+        Container()s will keep showing the old one.
+        '''
+        if is_container(self.container):
+            self.container._contents_changed()
+    
+    def resized(self):
+        '''
+        Notify the containers that the class has a different size now, so 
+        that layouts can make room for it.
+        '''
+        if is_container(self.container):
+            self.container._child_resized(self)
+    
     def kill(self):
+        for hotspot, handle in self._hotspots:
+            hotspot.remove(handle)
+        del self._hotspots[:]
         if is_container(self.container):
             self.container.remove(self)
     
+    def add_hotspot(self, hotspot, cfuncs, rfunc, z=None):
+        '''
+        Call hotspot.add_dynamic() with @cfuncs and @rfunc, and remember the 
+        handle so that kill() can remove the hotspot again. The hotspot is 
+        stacked like the class unless @z says otherwise.
+        '''
+        handle = hotspot.add_dynamic(cfuncs, rfunc, z or self.get_z)
+        self._hotspots.append((hotspot, handle))
+    
+    def get_z(self):
+        '''
+        Get the stacking key of the class: the keys of it and its containers 
+        within their containers, from the outermost in. Higher keys are drawn 
+        on top.
+        '''
+        c = self.container
+        if not is_container(c) or self not in c._stack:
+            return ()
+        return c.get_z() + (c._stack_key(self),)
+    
     ### Content management
     
     def add_to(self, container):
@@ -103,6 +284,71 @@ class Base(object):
         self.container = None
 
 
+class _HotspotProxy(object):
+    '''
+    Used internally to give each Container() its own view of the 
+    HotspotManager(). Hotspots are passed on to the parent only while the 
+    Container() is shown, so hidden hotspots are never looked at. Like the 
+    HotspotManager(), it hands out handles and holds bound methods weakly.
+    '''
+    def __init__(self, container, parent):
+        self.container = container
+        self.parent = parent
+        self.hotspots = OrderedDict()
+        self._attached = {}
+        self._handles = itertools.count()
+    
+    def add_static(self, cfuncs, rect, absolute=True, z=None):
+        return self._add(True, cfuncs, rect, z)
+    
+    def add_dynamic(self, cfuncs, rfunc, z=None):
+        return self._add(False, cfuncs, rfunc, z)
+    
+    def _add(self, static, cfuncs, where, z):
+        handle = next(self._handles)
+        cb = lambda wc: self.remove(handle)
+        cfuncs = tuple(weak_callable(f, cb) for f in cfuncs)
+        if not static:
+            where = weak_callable(where, cb)
+        z = weak_callable(z, cb)
+        self.hotspots[handle] = (static, cfuncs, where, z)
+        if self.container.shown:
+            self._attach(handle)
+        return handle
+    
+    def _attach(self, handle):
+        static, cfuncs, where, z = self.hotspots[handle]
+        if static:
+            self._attached[handle] = self.parent.add_static(cfuncs, where, 
+                    z=z)
+        else:
+            self._attached[handle] = self.parent.add_dynamic(cfuncs, where, z)
+    
+    def remove(self, handle):
+        self.hotspots.pop(handle, None)
+        if handle in self._attached:
+            self.parent.remove(self._attached.pop(handle))
+    
+    def restack(self):
+        self.parent.restack()
+    
+    def attach(self):
+        '''
+        Pass all of the hotspots on to the parent.
+        '''
+        for handle in self.hotspots:
+            if handle not in self._attached:
+                self._attach(handle)
+    
+    def detach(self):
+        '''
+        Take all of the hotspots back from the parent.
+        '''
+        for handle in self._attached.values():
+            self.parent.remove(handle)
+        self._attached.clear()
+
+
 class Container(Base):
     '''
     A combination of a Pygame Group and an EventManager, the Container() is a 
@@ -114,6 +360,32 @@ class Container(Base):
     within the Container(), which does all the hard work of translating these 
     relative values into absolute values. This opens up the ability to code 
     mega-widgets, as is possible in any full-desktop GUI toolkit.
+    
+    The absolute position of the Container() is cached, so converting 
+    positions costs a single addition no matter how deeply the Container() is 
+    nested. The cache is cleared whenever `.pos` is set, so move a Container() 
+    by assigning to `.pos` rather than by changing it in place.
+    
+    Contents are drawn in a well-defined order. Every item is on a layer 
+    (0 unless given otherwise to add()); higher layers are drawn on top of 
+    lower ones. Within a layer, widgets are drawn underneath sub-containers, 
+    and later additions are drawn on top of earlier ones of their kind. The 
+    drawing order is computed once and reused until something is added, 
+    removed or restacked.
+    
+    A Container() with static contents can be made `.cached`. It is then drawn 
+    once to an offscreen Surface(), which is reused until one of its items 
+    calls changed() (or is added, removed, moved, shown or hidden). 
+    get_cache_size() reports how much memory the caches use.
+    
+    While a Container() is hidden, the event handlers bound through it and 
+    the hotspots of its widgets are detached from the event manager, so 
+    hidden interfaces cost nothing per event either.
+    
+    update() only visits the items that have asked for it with schedule() 
+    (and everything newly added), so an idle interface costs nothing per 
+    frame. update_all() visits every widget, for widgets that are not written 
+    to schedule themselves.
     '''
     
     class _WrapCB(object):
@@ -122,49 +394,180 @@ class Container(Base):
             self.cb = cb
         
         def __call__(self, *args, **kw):
-            if self.container.shown:
-                self.cb(*args, **kw)
+            # Only called while shown; see set_shown()
+            return self.cb(*args, **kw)
     
     _iscontainer = True
     
-    def __init__(self, container, pos, shown=True):
-        Base.__init__(self, container)
-        
+    def __init__(self, container, pos, shown=True, cached=False):
         self.containers = set()
         self.widgets = set()
         self._event_cbs = {}
+        self._event_types = {}
+        self._origin = None
+        
+        # Stacking information: item -> [layer, sequence number]
+        self._stack = {}
+        self._front = itertools.count(1)
+        self._back = itertools.count(-1, -1)
+        # Cached drawing order, draw plan and flattened widget list
+        self._order = None
+        self._plan = None
+        self._flat = None
+        # Items waiting for update()
+        self._scheduled = set()
+        # Offscreen rendering
+        self.cached = cached
+        self._cache = None
+        self._cache_offset = Vector()
+        
+        Base.__init__(self, container)
         
-        self.shown = shown
-        self.pos = Vector(pos)
+        self._shown = shown
+        self.pos = pos
         
-        self.hotspot = container.hotspot
+        self.hotspot = _HotspotProxy(self, container.hotspot)
+        self.focus_manager = container.focus_manager
         self.Message = container.Message
     
     def __contains__(self, w):
         return w in self.widgets or w in self.containers
     
     def __iter__(self):
-        return itertools.chain(self.widgets, *self.containers)
+        if self._flat is None:
+            flat = []
+            for w in self.get_order():
+                if w in self.containers:
+                    flat.extend(w)
+                else:
+                    flat.append(w)
+            self._flat = flat
+        return iter(self._flat)
     
     def update(self):
-        for w in self:
+        '''
+        Update the items that have been scheduled since the last update().
+        '''
+        pending = self._scheduled
+        self._scheduled = set()
+        for w in pending:
             w.update()
     
-    def draw(self, surf):
+    def update_all(self):
         '''
-        Draw all widgets and sub-containers to @surf.
+        Update every widget, scheduled or not.
         '''
-        if self.shown:
-            for w in self.widgets:
-                surf.blit(w.image, self.convert_rect(w.rect))
-            for c in self.containers:
-                c.draw(surf)
+        # Sub-containers clear their own schedules, or they would never 
+        # schedule themselves with us again.
+        self._scheduled.clear()
+        for w in self.get_order():
+            if w in self.containers:
+                w.update_all()
+            else:
+                w.update()
+    
+    def _schedule(self, w):
+        '''
+        Used internally to schedule @w for the next update().
+        '''
+        # If something is scheduled already, so are we.
+        if not self._scheduled:
+            self.schedule()
+        self._scheduled.add(w)
+    
+    def draw(self, surf, shift=(0, 0)):
+        '''
+        Draw all widgets and sub-containers to @surf, offset by -@shift.
+        '''
+        if not self.shown:
+            return
+        if not self.cached:
+            self._cache = None
+            self._draw_contents(surf, shift)
+            return
+        if self._cache is None:
+            self._render_cache()
+        surf.blit(self._cache, self.get_origin() + self._cache_offset - shift)
+    
+    def _draw_contents(self, surf, shift, clip=None):
+        '''
+        Used internally to draw the contents of the Container() to @surf, 
+        offset by -@shift. If @clip is given, only the widgets that touch it 
+        (in absolute coordinates) are drawn.
+        '''
+        if self._plan is None:
+            self._build_plan()
+        origin = self.get_origin()
+        dest = origin - shift
+        for run, c in self._plan:
+            if clip is not None:
+                run = [w for w in run if clip.colliderect(w.rect.move(origin))]
+            if run:
+                _blit_all(surf, [(w.image, w.rect.move(dest)) for w in run])
+            if c is not None:
+                c.draw(surf, shift)
+    
+    def _render_cache(self):
+        '''
+        Used internally to draw the contents of the Container() to its cache.
+        '''
+        origin = self.get_origin()
+        area = self._get_extent() or Rect(origin, (0, 0))
+        self._cache = pygame.Surface(area.size, SRCALPHA)
+        self._cache_offset = Vector(area.topleft) - origin
+        self._draw_contents(self._cache, area.topleft)
+    
+    def _get_extent(self):
+        '''
+        Used internally to get the absolute area that drawing the contents 
+        can cover, or None if there is nothing to draw.
+        '''
+        rects = []
+        for w in self.get_order():
+            if w in self.containers:
+                r = w._get_extent()
+                if r is not None:
+                    rects.append(r)
+            else:
+                rects.append(self.convert_rect(w.rect))
+        return rects[0].unionall(rects[1:]) if rects else None
+    
+    def _contents_changed(self):
+        '''
+        Used internally to drop the cached rendering of the Container() and 
+        of all of its parents.
+        '''
+        self._cache = None
+        self.changed()
+    
+    def _child_resized(self, w):
+        '''
+        Used internally when the size of @w has changed. Does nothing in this 
+        class, but exists for the sake of layouts.
+        '''
+    
+    def get_cache_size(self):
+        '''
+        Get the number of bytes used by the caches of the Container() and of 
+        its sub-containers.
+        '''
+        size = 0
+        if self._cache is not None:
+            size += self._cache.get_pitch() * self._cache.get_height()
+        for c in self.containers:
+            size += c.get_cache_size()
+        return size
     
     def kill(self):
         '''
         Remove the class from its container, contained items and sub-widgets. 
         Runs automatically when the class is garbage collected.
         '''
+        # Handlers and hotspots go back while the parent is still known.
+        if getattr(self, '_shown', False):
+            self._detach()
+        self._event_types.clear()
+        self._event_cbs.clear()
         Base.kill(self)
         
         for c in self.containers:
@@ -172,27 +575,216 @@ class Container(Base):
         for w in self.widgets:
             w.remove_internal(self)
     
+    def add_internal(self, c):
+        Base.add_internal(self, c)
+        self._invalidate_origin()
+    
+    def remove_internal(self, c):
+        Base.remove_internal(self, c)
+        self._invalidate_origin()
+    
+    ### Position caching
+    
+    def get_pos(self):
+        return self._pos
+    
+    def set_pos(self, pos):
+        '''
+        Move the Container() to @pos, relative to its own container.
+        '''
+        self._pos = Vector(pos)
+        self._invalidate_origin()
+        self.changed()
+    pos = property(get_pos, set_pos)
+    
+    def get_shown(self):
+        return self._shown
+    
+    def set_shown(self, shown):
+        '''
+        Show or hide the Container().
+        '''
+        if shown != self._shown:
+            self._shown = shown
+            if shown:
+                self._attach()
+            else:
+                self._detach()
+            self.changed()
+    shown = property(get_shown, set_shown)
+    
+    def is_shown(self):
+        '''
+        Check whether the Container() and all of its parents are shown.
+        '''
+        if not self._shown:
+            return False
+        return self.container.is_shown() if is_container(self.container) \
+                else True
+    
+    def _attach(self):
+        '''
+        Used internally to pass event handlers and hotspots on to the parent.
+        '''
+        for func, etypes in self._event_types.items():
+            for etype, priority in etypes.items():
+                self.container.bind(self._event_cbs[func], etype, priority)
+        self.hotspot.attach()
+    
+    def _detach(self):
+        '''
+        Used internally to take event handlers and hotspots back from the 
+        parent, and the focus from any of the contents.
+        '''
+        for func, etypes in self._event_types.items():
+            for etype in etypes:
+                self.container.unbind(self._event_cbs[func], etype)
+        self.hotspot.detach()
+        
+        w = self.focus_manager.focused
+        while w is not None and w is not self:
+            w = getattr(w, 'container', None)
+        if w is self:
+            self.focus_manager.blur()
+    
+    def _calc_origin(self):
+        '''
+        Used internally to find the absolute position of the Container().
+        '''
+        return Vector(self.container.convert_point(self.pos))
+    
+    def _invalidate_origin(self):
+        '''
+        Used internally to clear the cached absolute position of the 
+        Container() and all of its sub-containers.
+        '''
+        # A sub-container can only have a cached origin if we have one too.
+        if self._origin is None:
+            return
+        self._origin = None
+        for c in self.containers:
+            c._invalidate_origin()
+    
+    def get_origin(self):
+        '''
+        Get the absolute position of the Container()'s contents.
+        '''
+        if self._origin is None:
+            self._origin = self._calc_origin()
+        return self._origin
+    
+    ### Stacking
+    
+    def _restack(self):
+        '''
+        Used internally to drop the cached drawing order.
+        '''
+        self._order = None
+        self._plan = None
+        self._invalidate_flat()
+        self._contents_changed()
+        self.hotspot.restack()
+    
+    def _invalidate_flat(self):
+        '''
+        Used internally to drop the flattened widget list of the Container() 
+        and all of its parents.
+        '''
+        self._flat = None
+        if is_container(self.container):
+            self.container._invalidate_flat()
+    
+    def _build_plan(self):
+        '''
+        Used internally to split the drawing order into runs of widgets, which 
+        can be blitted in one batch, separated by sub-containers.
+        '''
+        plan = []
+        run = []
+        for w in self.get_order():
+            if w in self.containers:
+                plan.append((tuple(run), w))
+                run = []
+            else:
+                run.append(w)
+        if run:
+            plan.append((tuple(run), None))
+        self._plan = plan
+    
+    def get_order(self):
+        '''
+        Get a list of the Container()'s direct contents, in drawing order.
+        '''
+        if self._order is None:
+            self._order = sorted(self._stack, key=self._stack_key)
+        return self._order
+    
+    def _stack_key(self, w):
+        '''
+        Used internally to get the sorting key of @w in the drawing order.
+        '''
+        layer, seq = self._stack[w]
+        return (layer, w in self.containers, seq)
+    
+    def get_layer_of(self, w):
+        '''
+        Get the layer of @w.
+        '''
+        return self._stack[w][0]
+    
+    def change_layer(self, w, layer):
+        '''
+        Move @w to the top of @layer.
+        '''
+        self._stack[w] = [layer, next(self._front)]
+        self._restack()
+    
+    def move_to_front(self, w):
+        '''
+        Draw @w on top of everything else of its kind on its layer.
+        '''
+        self._stack[w][1] = next(self._front)
+        self._restack()
+    
+    def move_to_back(self, w):
+        '''
+        Draw @w underneath everything else of its kind on its layer.
+        '''
+        self._stack[w][1] = next(self._back)
+        self._restack()
+    
     ### Content control
     
-    def add(self, *widgets):
+    def add(self, *widgets, **kw):
         '''
         Place @widgets under the blitting hand of the Container(). Each arg 
         must be a Widget(), a fellow Container(), or an iterable. Else, things 
-        get ugly...
+        get ugly... The optional keyword arg @layer sets the layer to place 
+        @widgets on (Defaults to 0).
         '''
+        layer = kw.pop('layer', 0)
+        if kw:
+            raise TypeError(
+                    'These keyword args are not allowed: %s' % kw.keys())
         for w in widgets:
             if is_widget(w):
                 if w not in self.widgets:
                     self.widgets.add(w)
+                    self._stack[w] = [layer, next(self._front)]
+                    self._restack()
                     w.add_internal(self)
+                    self._schedule(w)
             elif is_container(w):
                 if w not in self.containers:
                     self.containers.add(w)
+                    self._stack[w] = [layer, next(self._front)]
+                    self._restack()
                     w.add_internal(self)
+                    self._schedule(w)
             else:
                 # If it isn't an iterable, we'll get an error here.
                 # Desired effect.
-                self.add(*w)
+                self.add(*w, layer=layer)
     
     def remove(self, *widgets):
         '''
@@ -203,9 +795,15 @@ class Container(Base):
         for w in widgets:
             if w in self.widgets:
                 self.widgets.remove(w)
+                del self._stack[w]
+                self._scheduled.discard(w)
+                self._restack()
                 w.remove_internal(self)
             elif w in self.containers:
                 self.containers.remove(w)
+                del self._stack[w]
+                self._scheduled.discard(w)
+                self._restack()
                 w.remove_internal(self)
             else:
                 # If it isn't an iterable, we'll get an error here.
@@ -220,7 +818,7 @@ class Container(Base):
         be used for event considerations, blitting is handled directly by the 
         Container().
         '''
-        return self.container.convert_point(Vector(point) + self.pos)
+        return self.get_origin() + point
     
     def convert_rect(self, rect):
         '''
@@ -228,7 +826,7 @@ class Container(Base):
         used for event considerations, blitting is handled directly by the 
         Container().
         '''
-        return self.container.convert_rect(rect.move(self.pos))
+        return rect.move(self.get_origin())
     
     ### EventManager() compatibility methods
     
@@ -238,23 +836,33 @@ class Container(Base):
         '''
         self.container.event(utype, **kw)
     
-    def bind(self, func, etype):
+    def bind(self, func, etype, priority=0):
         '''
         Wraps around container.bind().
         '''
         if func not in self._event_cbs:
             wrapped = self._WrapCB(self, func)
             self._event_cbs[func] = wrapped
+            self._event_types[func] = {}
         else:
             wrapped = self._event_cbs[func]
-        self.container.bind(wrapped, etype)
+        if etype not in self._event_types[func]:
+            self._event_types[func][etype] = priority
+            if self.shown:
+                self.container.bind(wrapped, etype, priority)
     
     def unbind(self, func, etype):
         '''
         Wraps around container.unbind().
         '''
-        wrapped = self.event_cbs[func]
-        self.container.unbind(self, wrapped, etype)
+        wrapped = self._event_cbs[func]
+        del self._event_types[func][etype]
+        if not self._event_types[func]:
+            # Don't keep the object of @func alive through its wrapper.
+            del self._event_types[func]
+            del self._event_cbs[func]
+        if self.shown:
+            self.container.unbind(wrapped, etype)
 
 
 class Scrollable(Container):
@@ -264,31 +872,122 @@ class Scrollable(Container):
     NOTE: To add a background, add a Label() or other widget of the same size 
     as this widget in the same location. The other widget will be drawn 
     underneath this widget.
+    
+    The visible area is kept between frames. When the Scrollable() is scrolled 
+    by less than its size and nothing inside it has changed, the old picture 
+    is shifted with Surface.scroll() and only the newly exposed strip is 
+    redrawn.
     '''
     def __init__(self, eman, pos, size, shown=True):
+        self._offset = Vector()
+        self._area = None
+        # The rendered visible area, and the offset it was rendered at
+        self._view = None
+        self._view_offset = None
+        # ScrollBar()s to notify of scrolling, held weakly
+        self._bars = weakref.WeakSet()
         Container.__init__(self, eman, pos, shown)
-        self.offset = Vector()
         self.size = Vector(size)
     
-    def draw(self, surf):
+    def draw(self, surf, shift=(0, 0)):
+        if not self.shown:
+            return
         loc = self.container.convert_point(self.pos)
-        msurf = pygame.Surface(loc + self.size, SRCALPHA)
-        Container.draw(self, msurf)
-        surf.blit(msurf, loc, (loc, loc + self.size))
+        w, h = size = int(self.size.x), int(self.size.y)
+        
+        if self._view is None or self._view.get_size() != size:
+            self._view = pygame.Surface(size, SRCALPHA)
+            self._view_offset = None
+        
+        if self._view_offset is None:
+            self._repaint(Rect((0, 0), size), loc)
+        else:
+            dx = int(self.offset.x - self._view_offset.x)
+            dy = int(self.offset.y - self._view_offset.y)
+            if abs(dx) >= w or abs(dy) >= h:
+                self._repaint(Rect((0, 0), size), loc)
+            elif dx or dy:
+                self._view.scroll(-dx, -dy)
+                if dx:
+                    self._repaint(Rect(w - dx if dx > 0 else 0, 0, 
+                            abs(dx), h), loc)
+                if dy:
+                    self._repaint(Rect(0, h - dy if dy > 0 else 0, 
+                            w, abs(dy)), loc)
+        self._view_offset = Vector(self.offset)
+        
+        surf.blit(self._view, loc - shift)
     
     ### Internal methods
     
-    def _get_area(self):
-        rs = [w.container.convert_rect(w.rect) for w in self]
-        return Rect(0,0,0,0).unionall(rs).size - self.pos
+    def _repaint(self, area, loc):
+        '''
+        Used internally to redraw @area of the visible area, which is at 
+        absolute position @loc.
+        '''
+        self._view.set_clip(area)
+        self._view.fill((0, 0, 0, 0), area)
+        self._draw_contents(self._view, loc, area.move(loc))
+        self._view.set_clip(None)
+    
+    def _get_extent(self):
+        # Only the visible area is ever drawn, however long the contents are.
+        loc = self.container.convert_point(self.pos)
+        return Rect(int(loc.x), int(loc.y), int(self.size.x), int(self.size.y))
+    
+    def _contents_changed(self):
+        self._area = None
+        self._view_offset = None
+        Container._contents_changed(self)
     
     def _update(self):
-        x, y = self._get_area()
-        self.offset.x = limit(self.offset.x, 0, x - self.size.x)
-        self.offset.y = limit(self.offset.y, 0, y - self.size.y)
+        self._invalidate_origin()
+        x, y = self.get_area()
+        self.offset.x = limit(self.offset.x, 0, max(0, x - self.size.x))
+        self.offset.y = limit(self.offset.y, 0, max(0, y - self.size.y))
+        self._invalidate_origin()
+        self.changed()
+        for bar in self._bars:
+            bar.schedule()
+    
+    def _calc_origin(self):
+        return Container._calc_origin(self) - self.offset
+    
+    def get_offset(self):
+        return self._offset
+    
+    def set_offset(self, offset):
+        self._offset = Vector(offset)
+        self._invalidate_origin()
+        self.changed()
+    offset = property(get_offset, set_offset)
     
     ### External interface
     
+    def add_bar(self, bar):
+        '''
+        Have @bar scheduled whenever the Scrollable() scrolls. Only a weak 
+        reference to @bar is kept.
+        '''
+        self._bars.add(bar)
+    
+    def remove_bar(self, bar):
+        '''
+        Stop scheduling @bar; see add_bar().
+        '''
+        self._bars.discard(bar)
+    
+    def get_area(self):
+        '''
+        Get the size of the contents of the Scrollable().
+        '''
+        if self._area is None:
+            origin = self.get_origin()
+            rs = [w.container.convert_rect(w.rect).move(-origin.x, -origin.y) 
+                    for w in self]
+            self._area = Rect(0, 0, 0, 0).unionall(rs).bottomright
+        return self._area
+    
     def scroll_x(self, pixels, relative=True):
         '''
         Negative values for @pixels scroll left, positive values scroll right;
@@ -312,123 +1011,748 @@ class Scrollable(Container):
         else:
             self.offset.y = int(pixels)
         self._update()
-    
-    ### Sub-widget tools
-    
-    def convert_point(self, point):
-        '''
-        Same as Container().convert_point(), but adds scrolling.
-        '''
-        return Container.convert_point(self, point) - self.offset
-    
-    def convert_rect(self, rect):
-        '''
-        Same as Container().convert_rect(), but adds scrolling.
-        '''
-        return Container.convert_rect(self, rect).move(-self.offset)
 
 
-class Widget(Base):
+def _size_hint(w):
     '''
-    Widget() provides the base for all other Widget()s. See Label() for a 
-    reference Widget().
+    Used internally to get the preferred size of @w.
     '''
-    _iswidget = True
+    if hasattr(w, 'size_hint'):
+        return tuple(w.size_hint())
+    elif hasattr(w, 'rect'):
+        return w.rect.size
+    elif hasattr(w, 'size'):
+        return tuple(w.size)
+    return (0, 0)
 
 
-class Label(Widget):
+def _distribute(sizes, stretches, maxes, extra):
     '''
-    A basic Widget() that simply displays some content.
+    Used internally to share @extra pixels between @sizes in proportion to 
+    @stretches, without growing any size beyond its entry in @maxes (None for 
+    no limit). Returns the new sizes.
     '''
-    def __init__(self, container, pos, content):
-        '''
-        @container the container to which the Label() should be added;
-        @pos is the position of the upper-left corner of the Label();
-        @content is the Surface() to display;
-        '''
-        Widget.__init__(self, container)
-        self.rect = content.get_rect()
-        self.rect.move_ip(pos)
-        self.image = content
+    sizes = list(sizes)
+    active = [i for i in range(len(sizes)) if stretches[i] > 0]
+    while extra > 0 and active:
+        total = float(sum(stretches[i] for i in active))
+        left = extra
+        still = []
+        for i in active:
+            grow = int(extra * stretches[i] / total)
+            if maxes[i] is not None:
+                grow = min(grow, maxes[i] - sizes[i])
+            sizes[i] += grow
+            left -= grow
+            if maxes[i] is None or sizes[i] < maxes[i]:
+                still.append(i)
+        if left == extra:
+            # Only rounding leftovers remain; hand them out one by one.
+            for i in still[:left]:
+                sizes[i] += 1
+            break
+        extra = left
+        active = still
+    return sizes
 
 
-class ClickableWidget(Label):
+class Layout(Container):
     '''
-    A base class for clickable Widget()s.
+    The base for Container()s that position their contents automatically. 
+    Each item is given a cell based upon its size hint (a Widget()'s rect size 
+    or a sub-layout's size_hint()), which can be limited with the @min_size 
+    and @max_size constraints, and grown with @stretch when the layout has 
+    more room than it needs. Items that have a resize() method are resized to 
+    fit their cells; the others are placed at the top-left of their cells.
+    
+    Layouts are incremental. When an item's size changes (see 
+    Base.resized()), only the layouts on the way from it to the top are 
+    marked dirty; on relayout, sub-layouts whose size hint and allocated size 
+    are unchanged are skipped entirely. The top-level layout lays itself out 
+    when drawn, so there is normally no need to call relayout().
     '''
-    def __init__(self, container, pos, content):
+    def __init__(self, container, pos, spacing=0, shown=True):
+        self.spacing = spacing
+        self._constraints = {}
+        self._hint = None
+        self._alloc = None
+        self._laid_out = None
+        self._dirty = True
+        Container.__init__(self, container, pos, shown)
+    
+    ### Content control
+    
+    def add(self, *widgets, **kw):
+        '''
+        See documentation for Container().add(). Also takes the optional 
+        keyword args @min_size and @max_size, (w, h) tuples in which either 
+        value may be None for no limit, and @stretch, the share of any extra 
+        room to give to the items (Defaults to 0, no extra room).
+        '''
+        constraints = {}
+        for k in ('min_size', 'max_size', 'stretch'):
+            if k in kw:
+                constraints[k] = kw.pop(k)
+        Container.add(self, *widgets, **kw)
+        if constraints:
+            for w in widgets:
+                if w in self:
+                    self.set_constraints(w, **constraints)
+    
+    def set_constraints(self, w, min_size=None, max_size=None, stretch=0):
         '''
-        See documentation for Label();
+        Set the constraints for @w; see add() for the meaning of the args.
         '''
-        Label.__init__(self, container, pos, content)
-        container.hotspot.add_dynamic(
-                (self.callback, self.set_hover), self.get_rect)
-    
-    ### Override these
+        self._constraints[w] = (min_size or (None, None), 
+                max_size or (None, None), stretch)
+        self.invalidate()
     
-    def callback(self, eman, gstate, event):
-        pass
+    def _restack(self):
+        Container._restack(self)
+        self.invalidate()
     
-    def set_hover(self, eman, gstate, event, is_hovered):
-        pass
+    def _child_resized(self, w):
+        self.invalidate()
     
-    ### Useful defaults
+    ### Sizing
     
-    def get_rect(self, gstate):
-        return [self.container.convert_rect(self.rect)]
-
-
-class Button(ClickableWidget):
-    '''
-    A basic Button Widget().
-    '''
-    def __init__(self, container, pos, content, callback):
+    def _item_hint(self, w):
         '''
-        See documentation for ClickableWidget();
-        @content should be a (normal_content, active_content) tuple;
-        @callback: The function to be called when the Button() is clicked.
+        Used internally to get the size hint of @w, within its constraints.
         '''
-        self.cb = callback
+        hint = _size_hint(w)
+        mins, maxes = self._constraints.get(w, ((None, None), (None, None), 
+                0))[:2]
+        return tuple(limit(hint[i], mins[i], maxes[i]) for i in (0, 1))
+    
+    def _item_max(self, w, axis):
+        return self._constraints.get(w, (None, (None, None)))[1][axis]
+    
+    def _item_stretch(self, w):
+        return self._constraints.get(w, (None, None, 0))[2]
+    
+    def _place(self, w, pos, size):
+        '''
+        Used internally to move @w into the cell at @pos of @size.
+        '''
+        if hasattr(w, 'resize'):
+            w.resize(size)
+        if is_container(w):
+            if w.pos != pos:
+                w.pos = pos
+        elif w.rect.topleft != pos:
+            w.rect.topleft = pos
+            w.changed()
+    
+    def _arrange(self, size):
+        '''
+        Override this to position the items within @size.
+        '''
+    
+    def _calc_hint(self):
+        '''
+        Override this to compute the size the layout would like to have.
+        '''
+        return (0, 0)
+    
+    def size_hint(self):
+        '''
+        Get the size the layout would like to have.
+        '''
+        if self._hint is None:
+            self._hint = self._calc_hint()
+        return self._hint
+    
+    def get_size(self):
+        '''
+        Get the size the layout has been given, or its size hint otherwise.
+        '''
+        return self._alloc or self.size_hint()
+    size = property(get_size)
+    
+    def resize(self, size):
+        '''
+        Give the layout @size to lay out its items in. Pass None to go back to 
+        using the size hint.
+        '''
+        self._alloc = tuple(size) if size is not None else None
+        self.relayout()
+    
+    def invalidate(self):
+        '''
+        Mark the layout and all of the layouts containing it as needing to be 
+        laid out again.
+        '''
+        if self._dirty and self._hint is None:
+            return
+        self._dirty = True
+        self._hint = None
+        self.resized()
+    
+    def relayout(self):
+        '''
+        Lay out the items if anything has changed since the last time.
+        '''
+        size = self.get_size()
+        if not self._dirty and size == self._laid_out:
+            return
+        self._dirty = False
+        self._laid_out = size
+        self._arrange(size)
+    
+    def draw(self, surf, shift=(0, 0)):
+        if self._dirty and not isinstance(self.container, Layout):
+            self.relayout()
+        Container.draw(self, surf, shift)
+
+
+class Box(Layout):
+    '''
+    A Layout() that places its items next to each other in drawing order, 
+    in a row or, if @vertical is true, in a column.
+    '''
+    def __init__(self, container, pos, vertical=False, spacing=0, 
+            shown=True):
+        self.vertical = vertical
+        Layout.__init__(self, container, pos, spacing, shown)
+    
+    def _calc_hint(self):
+        a = int(self.vertical)
+        hints = [self._item_hint(w) for w in self.get_order()]
+        main = sum(h[a] for h in hints) + self.spacing * max(0, len(hints) - 1)
+        cross = max([h[1 - a] for h in hints] or [0])
+        return (cross, main) if a else (main, cross)
+    
+    def _arrange(self, size):
+        a = int(self.vertical)
+        items = self.get_order()
+        hints = [self._item_hint(w) for w in items]
+        lengths = _distribute([h[a] for h in hints], 
+                [self._item_stretch(w) for w in items], 
+                [self._item_max(w, a) for w in items], 
+                size[a] - self.size_hint()[a])
+        at = 0
+        for w, hint, length in zip(items, hints, lengths):
+            cross = hint[1 - a]
+            if self._item_stretch(w):
+                cross = limit(size[1 - a], None, self._item_max(w, 1 - a))
+            if a:
+                self._place(w, (0, at), (cross, length))
+            else:
+                self._place(w, (at, 0), (length, cross))
+            at += length + self.spacing
+
+
+class HBox(Box):
+    '''
+    A Box() that places its items in a row.
+    '''
+    def __init__(self, container, pos, spacing=0, shown=True):
+        Box.__init__(self, container, pos, False, spacing, shown)
+
+
+class VBox(Box):
+    '''
+    A Box() that places its items in a column.
+    '''
+    def __init__(self, container, pos, spacing=0, shown=True):
+        Box.__init__(self, container, pos, True, spacing, shown)
+
+
+class Grid(Layout):
+    '''
+    A Layout() that places its items in drawing order into rows of @columns 
+    cells each. Every column is as wide as its widest item and every row as 
+    tall as its tallest item; a column or row stretches as much as its most 
+    stretchable item.
+    '''
+    def __init__(self, container, pos, columns, spacing=0, shown=True):
+        self.columns = columns
+        Layout.__init__(self, container, pos, spacing, shown)
+    
+    def _tracks(self):
+        '''
+        Used internally to get the items, their hints, and the natural widths 
+        of the columns and heights of the rows.
+        '''
+        items = self.get_order()
+        hints = [self._item_hint(w) for w in items]
+        rows = (len(items) + self.columns - 1) // self.columns
+        widths = [0] * self.columns
+        heights = [0] * rows
+        for i, h in enumerate(hints):
+            r, c = divmod(i, self.columns)
+            widths[c] = max(widths[c], h[0])
+            heights[r] = max(heights[r], h[1])
+        return items, hints, widths, heights
+    
+    def _calc_hint(self):
+        items, hints, widths, heights = self._tracks()
+        gaps = lambda tracks: self.spacing * max(0, len(tracks) - 1)
+        return (sum(widths) + gaps(widths), sum(heights) + gaps(heights))
+    
+    def _arrange(self, size):
+        items, hints, widths, heights = self._tracks()
+        cstretch = [0] * len(widths)
+        rstretch = [0] * len(heights)
+        for i, w in enumerate(items):
+            r, c = divmod(i, self.columns)
+            cstretch[c] = max(cstretch[c], self._item_stretch(w))
+            rstretch[r] = max(rstretch[r], self._item_stretch(w))
+        hint = self.size_hint()
+        widths = _distribute(widths, cstretch, [None] * len(widths), 
+                size[0] - hint[0])
+        heights = _distribute(heights, rstretch, [None] * len(heights), 
+                size[1] - hint[1])
+        
+        xs = [sum(widths[:c]) + self.spacing * c for c in range(len(widths))]
+        ys = [sum(heights[:r]) + self.spacing * r 
+                for r in range(len(heights))]
+        for i, w in enumerate(items):
+            r, c = divmod(i, self.columns)
+            cell = hints[i]
+            if self._item_stretch(w):
+                cell = (limit(widths[c], None, self._item_max(w, 0)), 
+                        limit(heights[r], None, self._item_max(w, 1)))
+            self._place(w, (xs[c], ys[r]), cell)
+
+
+class Widget(Base):
+    '''
+    Widget() provides the base for all other Widget()s. See Label() for a 
+    reference Widget().
+    '''
+    _iswidget = True
+
+
+class Label(Widget):
+    '''
+    A basic Widget() that simply displays some content.
+    '''
+    def __init__(self, container, pos, content, size=None):
+        '''
+        @container the container to which the Label() should be added;
+        @pos is the position of the upper-left corner of the Label();
+        @content is the Surface() or skin to display;
+        @size is the size of the Label(), only used with skins (Defaults to 
+         the size of the skin's source).
+        '''
+        Widget.__init__(self, container)
+        if is_skin(content):
+            self.skin = content
+            content = content.get(size)
+        else:
+            self.skin = None
+        self.rect = content.get_rect()
+        self.rect.move_ip(pos)
+        self.natural_size = self.rect.size
+        self.image = content
+        if self.skin is not None:
+            self._reskin()
+    
+    def _reskin(self):
+        '''
+        Used internally to regenerate the images of skinned widgets after the 
+        size has changed. Override this if the widget uses other images than 
+        `.image`.
+        '''
+        self.image = self.skin.get(self.rect.size)
+    
+    def size_hint(self):
+        '''
+        Get the size the Label() would like to have.
+        '''
+        return self.natural_size if self.skin is not None else self.rect.size
+    
+    def resize(self, size):
+        '''
+        Change the size of the Label(). Only skinned widgets can be resized; 
+        for the others this does nothing.
+        '''
+        size = tuple(size)
+        if self.skin is None or size == self.rect.size:
+            return
+        self.rect.size = size
+        self._reskin()
+        self.changed()
+
+
+class ClickableWidget(Label):
+    '''
+    A base class for clickable Widget()s.
+    '''
+    def __init__(self, container, pos, content, size=None):
+        '''
+        See documentation for Label();
+        '''
+        Label.__init__(self, container, pos, content, size)
+        self.add_hotspot(container.hotspot, 
+                (self.callback, self.set_hover), self.get_rect)
+    
+    ### Override these
+    
+    def callback(self, eman, gstate, event):
+        pass
+    
+    def set_hover(self, eman, gstate, event, is_hovered):
+        pass
+    
+    ### Useful defaults
+    
+    def get_rect(self, gstate):
+        return [self.container.convert_rect(self.rect)]
+
+
+class Button(ClickableWidget):
+    '''
+    A basic Button Widget().
+    '''
+    def __init__(self, container, pos, content, callback, size=None):
+        '''
+        See documentation for ClickableWidget();
+        @content should be a (normal_content, active_content) tuple, or a 
+         skin, whose 'active' state will be used for the active content;
+        @callback: The function to be called when the Button() is clicked.
+        '''
+        self.cb = callback
         self.hover = False
-        self.content = content
-        ClickableWidget.__init__(self, container, pos, content[0])
+        if is_skin(content):
+            ClickableWidget.__init__(self, container, pos, content, size)
+        else:
+            self.content = content
+            ClickableWidget.__init__(self, container, pos, content[0])
+    
+    def _reskin(self):
+        self.content = (self.skin.get(self.rect.size), 
+                self.skin.get(self.rect.size, 'active'))
+        self.image = self.content[self.hover]
     
     def callback(self, eman, gstate, event):
         if event.type == MOUSEBUTTONDOWN and event.button == 1:
             self.cb(eman, gstate, event)
+            return STOP
     
     def set_hover(self, eman, gstate, event, is_hovered):
         if is_hovered and not self.hover:
             self.hover = True
             self.image = self.content[1]
+            self.changed()
         elif not is_hovered and self.hover:
             self.hover = False
             self.image = self.content[0]
+            self.changed()
+
+
+class ListView(ClickableWidget):
+    '''
+    A virtualized list Widget(). Rows are drawn by a renderer function as they 
+    come into view, and only the surfaces of the visible rows are kept, being 
+    reused as the list scrolls. Clicks are mapped to rows arithmetically, so 
+    the number of items has no effect on the per-frame or per-event cost.
+    
+    * Supports mouse-wheels.
+    NOTE: The widget schedules its own updates, but the update() of the 
+    top-level Container() must still be called every frame.
+    '''
+    def __init__(self, container, pos, content, items, renderer, row_height, 
+            **kw):
+        '''
+        Required Args:
+        See documentation for ClickableWidget(); @content is the background;
+        @items, the items to display, anything supporting len() and indexing;
+        @renderer, a function that is called with an item, its index, and 
+         whether it is selected, and returns the Surface() for its row;
+        @row_height, the height of each row in pixels.
+        
+        Optional Keyword Args:
+        @callback, the function to call when a row is clicked, will be called 
+         with the Widget() and the row's index (Defaults to a null function);
+        @wheel_rows, the number of rows to scroll per mouse-wheel step 
+         (Defaults to 3);
+        @size, the size of the Widget() when @content is a skin.
+        '''
+        self.select_cb = kw.pop('callback', lambda widget, index: None)
+        self.wheel_rows = kw.pop('wheel_rows', 3)
+        size = kw.pop('size', None)
+        if kw:
+            raise TypeError(
+                    'These keyword args are not allowed: %s' % kw.keys())
+        
+        self._rows = {}
+        ClickableWidget.__init__(self, container, pos, content, size)
+        
+        self.blank = self.image
+        self.renderer = renderer
+        self.row_height = row_height
+        self.items = items
+        
+        self.offset = 0
+        self.selected = None
+        self._dirty = True
+    
+    def _reskin(self):
+        self.image = self.blank = self.skin.get(self.rect.size)
+        self._invalidate()
+    
+    def _invalidate(self):
+        '''
+        Used internally to schedule a redraw.
+        '''
+        self._dirty = True
+        self.schedule()
+    
+    ### Internal methods
+    
+    def _row_at(self, pos):
+        '''
+        Used internally to find the index of the row at absolute @pos, or None.
+        '''
+        rect = self.container.convert_rect(self.rect)
+        if not rect.collidepoint(pos):
+            return None
+        i = (pos[1] - rect.top + self.offset) // self.row_height
+        return i if i < len(self.items) else None
+    
+    def _visible_range(self):
+        '''
+        Used internally to get the range of rows that are at least partially 
+        visible.
+        '''
+        first = self.offset // self.row_height
+        last = (self.offset + self.rect.h - 1) // self.row_height + 1
+        return range(first, min(last, len(self.items)))
+    
+    ### Event handling
+    
+    def callback(self, eman, gstate, event):
+        if event.type != MOUSEBUTTONDOWN:
+            return
+        if event.button == 4:
+            self.scroll(-self.wheel_rows * self.row_height)
+        elif event.button == 5:
+            self.scroll(self.wheel_rows * self.row_height)
+        elif event.button == 1:
+            i = self._row_at(event.pos)
+            if i is None:
+                return
+            self.select(i)
+            self.select_cb(self, i)
+        else:
+            return
+        return STOP
+    
+    ### External interface
+    
+    def set_items(self, items):
+        '''
+        Replace the items in the list.
+        '''
+        self.items = items
+        self.selected = None
+        self.refresh()
+        self.scroll(0)
+    
+    def refresh(self, index=None):
+        '''
+        Redraw the row at @index, or all rows if @index is None. Call this 
+        after changing the items.
+        '''
+        if index is None:
+            self._rows.clear()
+        else:
+            self._rows.pop(index, None)
+        self._invalidate()
+    
+    def select(self, index):
+        '''
+        Select the row at @index, or nothing if @index is None.
+        '''
+        if index != self.selected:
+            self.refresh(self.selected)
+            self.refresh(index)
+            self.selected = index
+    
+    def scroll(self, pixels, relative=True):
+        '''
+        Negative values for @pixels scroll up, positive values scroll down;
+        @relative determines whether to set the scroll value or change as 
+        above.
+        '''
+        offset = self.offset + pixels if relative else pixels
+        bottom = max(0, len(self.items) * self.row_height - self.rect.h)
+        offset = limit(int(offset), 0, bottom)
+        if offset != self.offset:
+            self.offset = offset
+            self._invalidate()
+    
+    def scroll_to(self, index):
+        '''
+        Scroll just far enough for the row at @index to be entirely visible.
+        '''
+        top = index * self.row_height
+        if top < self.offset:
+            self.scroll(top, False)
+        elif top + self.row_height > self.offset + self.rect.h:
+            self.scroll(top + self.row_height - self.rect.h, False)
+    
+    ### Updater
+    
+    def update(self):
+        '''
+        Update the image before drawing, if anything has changed.
+        '''
+        if not self._dirty:
+            return
+        self._dirty = False
+        
+        visible = self._visible_range()
+        rows = {}
+        for i in visible:
+            surf = self._rows.get(i)
+            if surf is None:
+                surf = self.renderer(self.items[i], i, i == self.selected)
+            rows[i] = surf
+        # Anything that scrolled out of view is dropped here.
+        self._rows = rows
+        
+        self.image = self.blank.copy()
+        y = -(self.offset % self.row_height)
+        for i in visible:
+            self.image.blit(rows[i], (0, y))
+            y += self.row_height
+        self.changed()
+
+
+class GapBuffer(object):
+    '''
+    A gap buffer for text storage. Text is kept in two lists of characters, 
+    one on each side of the gap, so inserting and deleting near the last edit 
+    costs O(1) per character no matter how long the text is. The joined string 
+    is cached between edits, so get() is cheap to call every frame.
+    
+    Indexing and slicing work on the joined string.
+    '''
+    def __init__(self, text=''):
+        # Characters before the gap, in order
+        self._pre = list(text)
+        # Characters after the gap, in *reverse* order
+        self._post = []
+        self._cache = None
+        # Bumped on every change, so that users can keep their own caches
+        self.version = 0
+    
+    def __len__(self):
+        return len(self._pre) + len(self._post)
+    
+    def __getitem__(self, key):
+        return self.get()[key]
+    
+    def __str__(self):
+        return self.get()
+    
+    def _move(self, pos):
+        '''
+        Used internally to move the gap to @pos.
+        '''
+        pre = self._pre
+        post = self._post
+        if pos < len(pre):
+            moved = pre[pos:]
+            del pre[pos:]
+            moved.reverse()
+            post.extend(moved)
+        elif pos > len(pre):
+            n = pos - len(pre)
+            moved = post[-n:]
+            del post[-n:]
+            moved.reverse()
+            pre.extend(moved)
+    
+    def _changed(self):
+        '''
+        Used internally to drop the cached string after an edit.
+        '''
+        self._cache = None
+        self.version += 1
+    
+    def get(self):
+        '''
+        Get the text as a string.
+        '''
+        if self._cache is None:
+            self._cache = ''.join(self._pre) + ''.join(reversed(self._post))
+        return self._cache
+    
+    def insert(self, pos, s):
+        '''
+        Insert string @s at @pos.
+        '''
+        if not s:
+            return
+        self._move(limit(pos, 0, len(self)))
+        self._pre.extend(s)
+        self._changed()
+    
+    def delete(self, pos, n=1):
+        '''
+        Remove up to @n characters starting at @pos and return them.
+        '''
+        pos = limit(pos, 0, len(self))
+        self._move(pos)
+        removed = self._post[-n:] if n > 0 else []
+        if removed:
+            del self._post[-n:]
+            removed.reverse()
+            self._changed()
+        return ''.join(removed)
+    
+    def pop(self, pos):
+        '''
+        Remove and return the character at @pos. Unlike list.pop(), negative 
+        positions are not allowed and raise an IndexError.
+        '''
+        if not 0 <= pos < len(self):
+            raise IndexError('GapBuffer index out of range')
+        return self.delete(pos)
+    
+    def clear(self):
+        '''
+        Remove all of the text.
+        '''
+        self._pre = []
+        self._post = []
+        self._changed()
 
 
 class Typable(Label):
     '''
     A base class for widgets that can typed in.
     
-    NOTE: Be sure to call update() every frame, or changes won't show up.
+    Keyboard events are delivered by the FocusManager() of the event manager, 
+    only while the widget has the focus. Clicking the widget gives it the 
+    focus, and clicking elsewhere inside @warea takes it away.
+    
+    NOTE: The widget schedules its own updates, but the update() of the 
+    top-level Container() must still be called every frame.
     '''
     def __init__(self, container, pos, warea, content, **kw):
         '''
         Required Args:
         See documentation for Label();
-        @warea, the area in which to check for clicks inside or outside the 
-         widget.
+        @warea, the absolute area in which clicks outside the widget take the 
+         focus away from it.
         
         Optional Keyword Args:
         @font, the pygame font to be used for drawing the text (Defaults to the 
          default pygame font in size 18);
         @color, the color to be used for drawing the text (Defaults to black);
         @margin, the text offset from the left side of the widget (Defaults to 
-         no margin).
+         no margin);
+        @size, the size of the widget when @content is a skin.
         '''
-        Label.__init__(self, container, pos, content)
+        Label.__init__(self, container, pos, content, kw.pop('size', None))
         
-        self.blank = content
+        self.blank = self.image
         self.font = kw.pop('font', pygame.font.Font(None, 18))
         self.color = kw.pop('color', (0, 0, 0))
         self.margin = (kw.pop('margin', 0), 0)
@@ -436,12 +1760,20 @@ class Typable(Label):
             raise TypeError(
                     'These keyword args are not allowed: %s' % kw.keys())
         
+        self.warea = warea
         self.focus = False
+        self._drawn = None
+        self.text = GapBuffer()
         self.reset()
         
-        container.hotspot.add_static(
-                [self.click_cb, lambda *args: None], warea)
-        container.bind(self.type_cb, KEYDOWN)
+        self.focus_manager = container.focus_manager
+        self.focus_manager.add(self)
+        self.add_hotspot(container.hotspot, (self.grab_cb, None), 
+                self.get_rect)
+    
+    def kill(self):
+        self.focus_manager.remove(self)
+        Label.kill(self)
     
     def bspace(self):
         '''
@@ -452,9 +1784,34 @@ class Typable(Label):
             self.cursor_loc -= 1
         except IndexError:
             pass
+        self.schedule()
+    
+    def _reskin(self):
+        self.image = self.blank = self.skin.get(self.rect.size)
+        self.schedule()
+    
+    ### Focus handling
+    
+    def get_rect(self, gstate):
+        return [self.container.convert_rect(self.rect)]
+    
+    def can_focus(self):
+        return self.container.is_shown()
+    
+    def set_focus(self, focus):
+        if focus != self.focus:
+            self.focus = focus
+            self.schedule()
+    
+    def grab_cb(self, eman, gstate, event):
+        if event.type == MOUSEBUTTONDOWN:
+            self.focus_manager.focus(self)
+            return STOP
     
     def click_cb(self, eman, gstate, event):
-        self.focus = True if self.rect.collidepoint(event.pos) else False
+        if (self.warea.collidepoint(event.pos) and not 
+                self.get_rect(gstate)[0].collidepoint(event.pos)):
+            self.focus_manager.blur()
     
     def type_cb(self, eman, gstate, event):
         if not self.focus:
@@ -466,6 +1823,7 @@ class Typable(Label):
             self.bspace()
         else:
             self.handle_other(event)
+        self.schedule()
     
     def handle_other(self, event):
         '''
@@ -478,33 +1836,42 @@ class Typable(Label):
         '''
         Clear the widget.
         '''
-        self.text = []
+        # Cleared in place, so that the version keeps counting up for the 
+        # caches keyed by it
+        self.text.clear()
         self.cursor_loc = 0
+        self.schedule()
     
     def get(self):
         '''
         Get the text from the widget.
         '''
-        return ''.join(self.text)
+        return self.text.get()
     
     def insert(self, s):
         '''
         Insert string @s at the current cursor location.
         '''
-        for c in s:
-            self.text.insert(self.cursor_loc, c)
-            self.cursor_loc += 1
+        self.text.insert(self.cursor_loc, s)
+        self.cursor_loc += len(s)
+        self.schedule()
     
     ### Updater
     
     def update(self):
         '''
-        Update the image before drawing.
+        Update the image before drawing, if the text has changed.
         '''
+        state = (self.text.version, self.blank)
+        if state == self._drawn:
+            return
+        self._drawn = state
+        
         self.image = self.blank.copy()
         vcenter_blit(self.image, 
                 self.font.render(self.get(), True, self.color), 
                 self.margin)
+        self.changed()
 
 
 class Entry(Typable):
@@ -604,16 +1971,28 @@ class Entry(Typable):
     
     def update(self):
         '''
-        Update the image before drawing.
+        Update the image before drawing, if anything has changed. While the 
+        Entry() is focused and the cursor blinks, it keeps itself scheduled.
         '''
+        show = self.cursor_shown and self.focus and pygame.key.get_focused()
+        if self.blink_frames != None and self.focus:
+            self.blinker += 1
+            self.blinker %= self.blink_frames
+            if not self.blinker:
+                self.cursor_shown = not self.cursor_shown
+            self.schedule()
+        
+        state = (self.text.version, self.cursor_loc, show, self.blank)
+        if state == self._drawn:
+            return
+        self._drawn = state
+        
         self.image = self.blank.copy()
         
-        bf = self.font.render(''.join(self.text[:self.cursor_loc]), 
-                True, self.color)
+        bf = self.font.render(self.text[:self.cursor_loc], True, self.color)
         br = bf.get_rect().move(self.margin)
         
-        af = self.font.render(''.join(self.text[self.cursor_loc:]), 
-                True, self.color)
+        af = self.font.render(self.text[self.cursor_loc:], True, self.color)
         
         cr = self.cursor.get_rect()
         cvec = Vector(br.w - cr.w, 0) + self.margin
@@ -626,20 +2005,450 @@ class Entry(Typable):
         vcenter_blit(self.image, bf, scroll + br)
         vcenter_blit(self.image, af, scroll + br.topright)
         
-        if self.cursor_shown and self.focus and pygame.key.get_focused():
+        if show:
             vcenter_blit(self.image, self.cursor, scroll + cvec)
+        self.changed()
+
+
+class TextArea(Typable):
+    '''
+    A multi-line text widget, which supports navigation, a cursor, delete,
+    and page scrolling. The line layout is cached between edits and only the
+    lines that fit inside the widget are rendered, so even logs or chat
+    consoles with tens of thousands of lines stay responsive.
+    
+    NOTE: The widget schedules its own updates, but the update() of the 
+    top-level Container() must still be called every frame.
+    '''
+    def __init__(self, container, pos, warea, content, cursor, **kw):
+        '''
+        Required Args:
+        See documentation for Typable();
+        @cursor, the pygame surface that will be used as the cursor.
         
-        if self.blink_frames != None:
-            self.blinker += 1
-            self.blinker %= self.blink_frames
-            if not self.blinker:
-                self.cursor_shown = not self.cursor_shown
+        Optional Keyword Args:
+        See documentation for Typable();
+        @spacing, the number of extra pixels between lines (Defaults to 0);
+        @read_only, whether typing is disabled; navigation and append() still
+         work (Defaults to False);
+        @follow, whether to keep the last line in view when text is appended
+         at the end (Defaults to True).
+        '''
+        self.spacing = kw.pop('spacing', 0)
+        self.read_only = kw.pop('read_only', False)
+        self.follow = kw.pop('follow', True)
+        
+        # Line layout cache; see _layout()
+        self._lines = ['']
+        self._starts = [0]
+        self._layout_version = 0
+        # Rendered line cache, keyed by line text
+        self._rendered = {}
+        
+        self.top = 0
+        self.cursor = cursor
+        
+        Typable.__init__(self, container, pos, warea, content, **kw)
+        
+        self.line_height = self.font.get_linesize() + self.spacing
+    
+    ### Internal methods
+    
+    def _layout(self):
+        '''
+        Used internally to rebuild the line layout if the text has changed.
+        '''
+        if self._layout_version == self.text.version:
+            return
+        self._lines = self.text.get().split('\n')
+        starts = [0] * len(self._lines)
+        loc = 0
+        for i, line in enumerate(self._lines):
+            starts[i] = loc
+            loc += len(line) + 1
+        self._starts = starts
+        self._layout_version = self.text.version
+    
+    def _render_line(self, line):
+        '''
+        Used internally to get a rendered line, reusing previous renders.
+        '''
+        surf = self._rendered.get(line)
+        if surf is None:
+            # Only a few screens' worth of lines are worth keeping around.
+            if len(self._rendered) > 4 * self.visible_lines():
+                self._rendered.clear()
+            surf = self.font.render(line, True, self.color)
+            self._rendered[line] = surf
+        return surf
+    
+    def _set_cursor(self, line, col):
+        '''
+        Used internally to move the cursor to column @col of line @line.
+        '''
+        line = limit(line, 0, len(self._lines) - 1)
+        col = limit(col, 0, len(self._lines[line]))
+        self.cursor_loc = self._starts[line] + col
+    
+    def _show_cursor(self):
+        '''
+        Used internally to scroll the cursor's line into view.
+        '''
+        line = self.get_cursor()[0]
+        if line < self.top:
+            self.top = line
+        elif line >= self.top + self.visible_lines():
+            self.top = line - self.visible_lines() + 1
+    
+    ### Event handling
+    
+    def type_cb(self, eman, gstate, event):
+        if not self.focus:
+            return
+        if self.read_only:
+            self.handle_other(event)
+        else:
+            Typable.type_cb(self, eman, gstate, event)
+        self._show_cursor()
+        self.schedule()
+    
+    def handle_other(self, event):
+        self._layout()
+        line, col = self.get_cursor()
+        
+        if event.key == K_RETURN:
+            if not self.read_only:
+                self.insert('\n')
+        elif event.key == K_DELETE:
+            if not self.read_only:
+                self.text.delete(self.cursor_loc)
+        elif event.key == K_HOME:
+            self._set_cursor(line, 0)
+        elif event.key == K_END:
+            self._set_cursor(line, len(self._lines[line]))
+        elif event.key == K_UP:
+            self._set_cursor(line - 1, col)
+        elif event.key == K_DOWN:
+            self._set_cursor(line + 1, col)
+        elif event.key == K_PAGEUP:
+            self._set_cursor(line - self.visible_lines(), col)
+        elif event.key == K_PAGEDOWN:
+            self._set_cursor(line + self.visible_lines(), col)
+        elif event.key == K_RIGHT:
+            self.cursor_loc += 1
+        elif event.key == K_LEFT:
+            self.cursor_loc -= 1
+        
+        self.cursor_loc = limit(self.cursor_loc, 0, len(self.text))
+    
+    ### External interface
+    
+    def append(self, s):
+        '''
+        Add string @s to the end of the text without moving the cursor, unless
+        it is already at the end. Only the affected lines are re-laid out, so
+        this is the method to use for logs and consoles.
+        '''
+        at_end = self.cursor_loc == len(self.text)
+        self._layout()
+        
+        self.text.insert(len(self.text), s)
+        
+        lines = self._lines
+        starts = self._starts
+        pieces = s.split('\n')
+        lines[-1] += pieces[0]
+        for p in pieces[1:]:
+            starts.append(starts[-1] + len(lines[-1]) + 1)
+            lines.append(p)
+        self._layout_version = self.text.version
+        
+        if at_end:
+            self.cursor_loc = len(self.text)
+        if self.follow:
+            self.scroll_to(len(self._lines))
+        self.schedule()
+    
+    def line_count(self):
+        '''
+        Get the number of lines in the widget.
+        '''
+        self._layout()
+        return len(self._lines)
+    
+    def get_line(self, i):
+        '''
+        Get line @i from the widget.
+        '''
+        self._layout()
+        return self._lines[i]
+    
+    def get_cursor(self):
+        '''
+        Get the cursor's location as a (line, column) tuple.
+        '''
+        self._layout()
+        line = bisect.bisect_right(self._starts, self.cursor_loc) - 1
+        return line, self.cursor_loc - self._starts[line]
+    
+    def visible_lines(self):
+        '''
+        Get the number of lines that fit in the widget.
+        '''
+        return max(1, self.rect.h // self.line_height)
+    
+    def scroll_to(self, line):
+        '''
+        Scroll so that @line is the top line, or as close as possible.
+        '''
+        self._layout()
+        bottom = max(0, len(self._lines) - self.visible_lines())
+        self.top = limit(line, 0, bottom)
+        self.schedule()
+    
+    def scroll(self, lines):
+        '''
+        Negative values for @lines scroll up, positive values scroll down.
+        '''
+        self.scroll_to(self.top + lines)
+    
+    ### Updater
+    
+    def update(self):
+        '''
+        Update the image before drawing, if anything has changed. Only the 
+        visible lines are rendered.
+        '''
+        self._layout()
+        show = self.focus and pygame.key.get_focused()
+        state = (self.text.version, self.cursor_loc, self.top, show, 
+                self.blank)
+        if state == self._drawn:
+            return
+        self._drawn = state
+        
+        self.image = self.blank.copy()
+        
+        end = min(self.top + self.visible_lines(), len(self._lines))
+        y = 0
+        for i in range(self.top, end):
+            self.image.blit(self._render_line(self._lines[i]),
+                    (self.margin[0], y))
+            y += self.line_height
+        
+        if show:
+            line, col = self.get_cursor()
+            if self.top <= line < end:
+                x = self.margin[0] + self.font.size(self._lines[line][:col])[0]
+                y = (line - self.top) * self.line_height
+                self.image.blit(self.cursor, (x, y))
+        self.changed()
 
 
 class ScrollBar(ClickableWidget):
     '''
-    A ScrollBar Widget().
+    A ScrollBar Widget() for a Scrollable().
     
-    * Supports mouse-wheels.
-    TODO: Implement!
+    * Supports mouse-wheels, over both the ScrollBar() and the Scrollable().
+    * Supports dragging the thumb, and clicking the track to page.
+    * Supports smooth scrolling for the wheel and paging, and kinetic 
+      scrolling after a drag.
+    NOTE: The widget schedules its own updates, but the update() of the 
+    top-level Container() must still be called every frame.
     '''
+    def __init__(self, container, pos, content, thumb, target, **kw):
+        '''
+        Required Args:
+        See documentation for ClickableWidget(); @content is the track;
+        @thumb, the Surface() to use for the draggable thumb;
+        @target, the Scrollable() to control.
+        
+        Optional Keyword Args:
+        @vertical, whether to scroll vertically (Defaults to True);
+        @wheel_step, the number of pixels to scroll per mouse-wheel step 
+         (Defaults to 30);
+        @smooth, the fraction of the remaining distance covered per update 
+         when scrolling by wheel or page, or None to jump (Defaults to None);
+        @friction, the fraction of its speed a released drag keeps per 
+         update, or None to stop at once (Defaults to None);
+        @size, the size of the track when @content is a skin.
+        '''
+        self.vertical = kw.pop('vertical', True)
+        self.wheel_step = kw.pop('wheel_step', 30)
+        self.smooth = kw.pop('smooth', None)
+        self.friction = kw.pop('friction', None)
+        size = kw.pop('size', None)
+        if kw:
+            raise TypeError(
+                    'These keyword args are not allowed: %s' % kw.keys())
+        
+        self._thumb_pos = None
+        self._events = None
+        ClickableWidget.__init__(self, container, pos, content, size)
+        
+        self.track = self.image
+        self.thumb = thumb
+        self.target = target
+        
+        self.goal = None
+        self.velocity = 0
+        self.grab = None
+        
+        # The target schedules us whenever it scrolls.
+        target.add_bar(self)
+        # Stacked with the target, so that its contents come first
+        self.add_hotspot(container.hotspot, (self.wheel_cb, None), 
+                lambda gstate: [target.container.convert_rect(
+                        Rect(target.pos, target.size))], target.get_z)
+        container.bind(self.release_cb, MOUSEBUTTONUP)
+        # Kept, so that kill() can unbind from the same place
+        self._events = container
+    
+    def _reskin(self):
+        self.image = self.track = self.skin.get(self.rect.size)
+        self._thumb_pos = None
+        self.schedule()
+    
+    def kill(self):
+        self.target.remove_bar(self)
+        if self._events is not None:
+            self._events.unbind(self.release_cb, MOUSEBUTTONUP)
+            self._events = None
+        ClickableWidget.kill(self)
+    
+    ### Geometry
+    
+    def _axis(self, pair):
+        '''
+        Used internally to pick the scrolling axis out of @pair.
+        '''
+        return pair[1] if self.vertical else pair[0]
+    
+    def get_offset(self):
+        '''
+        Get the scrolling offset of the target.
+        '''
+        return self._axis(self.target.offset)
+    
+    def get_max(self):
+        '''
+        Get the largest possible scrolling offset of the target.
+        '''
+        return max(0, self._axis(self.target.get_area()) - 
+                self._axis(self.target.size))
+    
+    def get_travel(self):
+        '''
+        Get the distance in pixels that the thumb can move.
+        '''
+        return max(0, self._axis(self.rect.size) - 
+                self._axis(self.thumb.get_size()))
+    
+    def get_thumb_pos(self):
+        '''
+        Get the position of the thumb along the track.
+        '''
+        m = self.get_max()
+        return self.get_travel() * self.get_offset() // m if m else 0
+    
+    ### Scrolling
+    
+    def set_offset(self, offset):
+        '''
+        Scroll the target to @offset immediately.
+        '''
+        if self.vertical:
+            self.target.scroll_y(offset, False)
+        else:
+            self.target.scroll_x(offset, False)
+    
+    def scroll(self, pixels):
+        '''
+        Scroll the target by @pixels, smoothly if so configured.
+        '''
+        self.velocity = 0
+        if self.smooth is None:
+            self.set_offset(self.get_offset() + pixels)
+        else:
+            start = self.get_offset() if self.goal is None else self.goal
+            self.goal = limit(start + pixels, 0, self.get_max())
+            self.schedule()
+    
+    ### Event handling
+    
+    def callback(self, eman, gstate, event):
+        if event.type != MOUSEBUTTONDOWN:
+            return
+        if event.button in (4, 5):
+            return self.wheel_cb(eman, gstate, event)
+        elif event.button == 1:
+            rect = self.container.convert_rect(self.rect)
+            loc = self._axis(event.pos) - self._axis(rect.topleft)
+            thumb = self.get_thumb_pos()
+            if thumb <= loc < thumb + self._axis(self.thumb.get_size()):
+                self.goal = None
+                self.velocity = 0
+                self.grab = loc - thumb
+            else:
+                # Page towards the click
+                page = self._axis(self.target.size)
+                self.scroll(page if loc > thumb else -page)
+            return STOP
+    
+    def wheel_cb(self, eman, gstate, event):
+        if event.type != MOUSEBUTTONDOWN:
+            return
+        if event.button == 4:
+            self.scroll(-self.wheel_step)
+        elif event.button == 5:
+            self.scroll(self.wheel_step)
+        else:
+            return
+        return STOP
+    
+    def release_cb(self, eman, gstate, event):
+        if event.button == 1 and self.grab is not None:
+            self.grab = None
+            if self.friction is None:
+                self.velocity = 0
+            self.schedule()
+    
+    def set_hover(self, eman, gstate, event, is_hovered):
+        # Drags are followed even when the mouse leaves the ScrollBar().
+        if self.grab is None or event.type != MOUSEMOTION:
+            return
+        travel = self.get_travel()
+        if not travel:
+            return
+        rect = self.container.convert_rect(self.rect)
+        thumb = self._axis(event.pos) - self._axis(rect.topleft) - self.grab
+        old = self.get_offset()
+        self.set_offset(self.get_max() * limit(thumb, 0, travel) // travel)
+        self.velocity = self.get_offset() - old
+    
+    ### Updater
+    
+    def update(self):
+        '''
+        Move the target for smooth or kinetic scrolling, and update the image 
+        if the thumb has moved. Moving the target schedules the next update.
+        '''
+        if self.goal is not None:
+            remaining = self.goal - self.get_offset()
+            step = int(remaining * self.smooth)
+            if not step:
+                self.set_offset(self.goal)
+                self.goal = None
+            else:
+                self.set_offset(self.get_offset() + step)
+        elif self.grab is None and self.velocity:
+            self.set_offset(self.get_offset() + self.velocity)
+            self.velocity = int(self.velocity * self.friction)
+        
+        thumb = self.get_thumb_pos()
+        if thumb != self._thumb_pos:
+            self._thumb_pos = thumb
+            self.image = self.track.copy()
+            self.image.blit(self.thumb, 
+                    (0, thumb) if self.vertical else (thumb, 0))
+            self.changed()
@@ -25,30 +25,33 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 __version__ = '1.14.2'
 
+import bisect
 import importlib
+import itertools
 import random
 import os
 import sys
+import threading
+import weakref
 import pygame
 
+from collections import OrderedDict
+
 from os import listdir as ls
 from os.path import join
 
-from pms import Playlist
-from common import get_ext
+import pms
+from common import get_ext, weak_callable, STOP
 
-from pgpu.math_utils import limit
+try:
+    intern
+except NameError:
+    from sys import intern
 
 # an advanced feature that allows loading a start time for musics
-# as well as a certain decision between ogg music and ogg sounds
-loaders = {}
-# Use the pyslim interface to any available loaders
+# as well as a certain decision between ogg music and ogg sounds; 
+# pyslim reads just these tags from the headers, without any backend
 import pyslim
-# The default; presents all the interface we need
-dummy = lambda filename: {}
-for ext in ['ogg', 'mp3']:
-    loaders[ext] = pyslim.ldict.get(ext, dummy)
-del dummy
 
 IMAGE_TYPES = ['jpg', 'jpeg', 'jpe', 'png', 'gif', 'bmp', 'pcx', 'pcc', 'tga', 
         'tif', 'tiff', 'lbm', 'pbm', 'pgm', 'ppm', 'xpm']
@@ -61,6 +64,11 @@ T_PLAYLIST = 4
 T_OTHER = 5
 
 METAEVENT = 31
+# Posted at the end of music tracks, and when the next one has been read
+MUSICEVENT = 30
+WARMEVENT = 29
+# Posted when a crossfaded track ends
+FADEEVENT = 28
 
 def guess_type(fl):
     ext = get_ext(fl)
@@ -71,10 +79,10 @@ def guess_type(fl):
     elif ext in ['mp3']:
         return T_MUSIC
     elif ext in ['ogg']:
-        tag = loaders[ext](fl).get('gtype')
+        tag = pyslim.read_tags(fl, ['gtype']).get('gtype')
         if tag != None:
             # trump the 100 KB rule by setting the gtype tag in metadata
-            return int(tag)
+            return int(tag[0])
         elif os.path.getsize(fl) > 1024 * 100:    # 100 KB
             return T_MUSIC
         else:
@@ -87,6 +95,38 @@ def guess_type(fl):
         return T_OTHER
 
 
+class Handle(object):
+    '''
+    A reference to a resource, as returned by Resources.image_handle() and 
+    the like. `.value` is the resource itself, or None while it isn't loaded. 
+    It follows reloads, so hold on to the Handle() rather than its value.
+    '''
+    __slots__ = ['value']
+    
+    def __init__(self, value=None):
+        self.value = value
+
+
+class MusicRecord(object):
+    '''
+    A loaded music track, as handed out by resolved playlists. The start 
+    time from its metadata, `.gstart`, is only read when first needed.
+    '''
+    def __init__(self, loc, group, title):
+        self.loc = loc
+        self.group = group
+        self.title = title
+        self.ext = get_ext(loc)
+        self._gstart = None
+    
+    def get_gstart(self):
+        if self._gstart is None:
+            tags = pyslim.read_tags(self.loc, ['gstart'])
+            self._gstart = float(tags.get('gstart', [0])[0])
+        return self._gstart
+    gstart = property(get_gstart)
+
+
 class Sound(pygame.mixer.Sound):
     def __init__(self, snd, resources):
         pygame.mixer.Sound.__init__(self, snd)
@@ -116,6 +156,11 @@ class Resources(object):
     handled by playlists. These playlists are in a PMS (Pyramid MetaSong) 
     format, which is described in the `pms` module.
     
+    Objects that are needed often, such as sprite images drawn every frame, 
+    are best retrieved once with `.image_handle()`, `.sound_handle()` or 
+    `.code_handle()`. These return a Handle(), whose `.value` is the object 
+    without any lookups, and which follows the object when it is reloaded.
+    
     The external interface can be controlled by changing the playlist (the 
     name of which is determined by the file's name) (`.set_playlist()`), the 
     volume (`.set_m_vol()`), and going to the next track (`.next_song()`). 
@@ -124,6 +169,17 @@ class Resources(object):
     not managed by this object. When a track ends, your program should 
     notify the Resource() object by calling `.track_finished()`.
     
+    Alternatively, `.bind_music()` lets the Resources() handle the ends of 
+    tracks itself. It then looks ahead in the playlist, reads the next file 
+    on a background thread, and queues it in the mixer, so that tracks play 
+    back to back. Tracks with a start time in their metadata cannot be 
+    queued; they are loaded when the previous track ends, as before. With 
+    @crossfade, switching playlists fades the old track out and the new one 
+    in; the new track is decoded into a Sound on a background thread and 
+    played on one of two reserved channels, and the music stream takes over 
+    again with the track after it. Switching again mid-fade fades the track 
+    on that channel out on its own.
+    
     If you wish to use the code loading features of Resources(), there are 
     some important things to remember. First, the code files must be 
     positioned in the same way as a image or sound. For instance, if you 
@@ -145,15 +201,31 @@ class Resources(object):
     on '~/.inevitable/data', a possible mainfile would be 
     '~/.inevitable/data/trigger/__init__.py'.
     '''
-    def __init__(self, channels=16, dynamic=False):
+    def __init__(self, channels=16, dynamic=False, cache_playlists=False, 
+            crossfade=0):
         '''
         The number of sound channels can be set using @channels, and can be 
-        allowed to grow on demand by making @dynamic true.
+        allowed to grow on demand by making @dynamic true. If 
+        @cache_playlists is true, compiled playlists are cached next to their 
+        files (see `pms.load()`). @crossfade is the time in milliseconds to 
+        crossfade for when switching playlists; it takes effect once 
+        `.bind_music()` has been called.
         '''
+        self._handles = {}
+        self.cache_playlists = cache_playlists
+        self.crossfade = crossfade
+        self._endevent = None
+        self._generation = 0
         self.reset()
         self.channels = channels
         self.dynamic = bool(dynamic)
         pygame.mixer.set_num_channels(channels)
+        if crossfade:
+            # Keep the first two channels for crossfading, so that a track 
+            # on one can fade out while the next fades in on the other.
+            pygame.mixer.set_reserved(2)
+            self._fade_channel = pygame.mixer.Channel(0)
+            self._spare_channel = pygame.mixer.Channel(1)
     
     def reset(self):
         self.music = {}
@@ -161,9 +233,23 @@ class Resources(object):
         self.images = {}
         self.code = {}
         self.playlists = {}
+        self._unresolved = []
         self.cur_playlist = ''
+        self.playlist = None
+        # The track coming up next, and whether it is queued in the mixer
+        self._upcoming = None
+        self._queued = False
+        self._generation += 1
+        # (record, generation) pairs from the read-ahead threads
+        self._warmed = []
+        # (record, generation, sound) tuples from the decoding threads
+        self._decoded = []
+        # The track playing on the crossfading channel
+        self._fading = None
         self.m_vol = .13
         self.s_vol = .13
+        for handle in self._handles.values():
+            handle.value = None
     
     ### Internal loader methods
     
@@ -173,7 +259,9 @@ class Resources(object):
         load_objects().
         '''
         self.images.setdefault(group, {})
-        self.images[group][title] = pygame.image.load(loc).convert_alpha()
+        image = pygame.image.load(loc).convert_alpha()
+        self.images[group][title] = image
+        self._update_handle(T_IMAGE, group, title, image)
     
     def load_music(self, loc, title, group):
         '''
@@ -181,16 +269,26 @@ class Resources(object):
         load_objects().
         '''
         self.music.setdefault(group, {})
-        self.music[group][title] = loc
+        self.music[group][title] = MusicRecord(loc, group, title)
     
     def load_playlist(self, loc, title):
         '''
         Used internally when loading playlists. You should probably use 
         load_objects().
         '''
-        lines = [l.strip() for l in open(loc).readlines()]
-        self.playlists.setdefault(title, [])
-        self.playlists[title].append(Playlist(lines, True))
+        plist = pms.load(loc, True, cache=self.cache_playlists)
+        self.playlists.setdefault(title, []).append(plist)
+        self._unresolved.append(plist)
+    
+    def resolve_playlists(self):
+        '''
+        Used internally to bind the tracks of newly loaded playlists to their 
+        music. You should probably use load_objects().
+        '''
+        lookup = lambda group, title: self.music[group.lower()][title.lower()]
+        for plist in self._unresolved:
+            plist.resolve(lookup)
+        del self._unresolved[:]
     
     def load_sound(self, loc, title, group):
         '''
@@ -198,7 +296,9 @@ class Resources(object):
         load_objects().
         '''
         self.sounds.setdefault(group, {})
-        self.sounds[group][title] = Sound(loc, self)
+        sound = Sound(loc, self)
+        self.sounds[group][title] = sound
+        self._update_handle(T_SOUND, group, title, sound)
     
     def load_code(self, path, package, callwith):
         '''
@@ -209,13 +309,17 @@ class Resources(object):
         g_o = importlib.import_module(package).get_objects
         del sys.path[0]
         for obj in g_o(callwith):
-            self.code[obj.title.lower()] = obj
+            title = intern(obj.title.lower())
+            self.code[title] = obj
+            self._update_handle(T_CODE, None, title, obj)
     
     
     def load_objects(self, dirs=[], callwith={}):
         '''
         Call this to load resources from each dir in @dirs. Code resources will 
-        receive @callwith as an argument.
+        receive @callwith as an argument. Afterwards, the tracks of the loaded 
+        playlists are looked up; playlists with unknown tracks raise a 
+        ValueError, so load music no later than the playlists that use it.
         '''
         for d in dirs:
             contents = ls(d)
@@ -223,23 +327,24 @@ class Resources(object):
                 first = join(d, t)
                 if t.startswith('.') or os.path.isfile(first):
                     continue
-                t_l = t.lower()
+                t_l = intern(t.lower())
                 for fl in ls(first):
                     full = join(first, fl)
                     if fl.startswith('.') or os.path.isdir(full):
                         continue
-                    fl_n = fl.lower().rsplit('.', 1)[0]
+                    fl_n = intern(fl.lower().rsplit('.', 1)[0])
                     ty = guess_type(full)
                     if ty == T_IMAGE:
-                        self.load_image(full, fl_n, t)
+                        self.load_image(full, fl_n, t_l)
                     elif ty == T_SOUND:
-                        self.load_sound(full, fl_n, t)
+                        self.load_sound(full, fl_n, t_l)
                     elif ty == T_MUSIC:
-                        self.load_music(full, fl_n, t)
+                        self.load_music(full, fl_n, t_l)
                     elif ty == T_CODE and fl_n == '__init__':
                         self.load_code(d, t, callwith)
                     elif ty == T_PLAYLIST:
                         self.load_playlist(full, fl_n)
+        self.resolve_playlists()
     
     
     def get_playlist(self):
@@ -253,21 +358,191 @@ class Resources(object):
         plylst = plylst.lower()
         if plylst != self.cur_playlist or force:
             self.cur_playlist = plylst
-            self.play_song(self.get_playlist().begin())
+            self.playlist = self.get_playlist()
+            record = self.playlist.begin()
+            if (self.crossfade and self._endevent is not None and 
+                    (pygame.mixer.music.get_busy() or 
+                    self._fading is not None)):
+                self._crossfade_to(record)
+            else:
+                self.play_song(record)
     
     def next_song(self):
         '''
         Go to the next song in the playlist.
         '''
-        self.play_song(self.get_playlist().next())
+        self.play_song(self.playlist.next())
     
-    def play_song(self, stup):
-        group, title = stup
-        f = self.music[group][title]
-        pygame.mixer.music.load(f)
-        ext = get_ext(f)
+    def play_song(self, record):
+        '''
+        Play @record, a MusicRecord() or a (group, title) tuple.
+        '''
+        if isinstance(record, tuple):
+            group, title = record
+            record = self.music[group][title]
+        # Whatever was coming up is out of date now.
+        self._generation += 1
+        self._upcoming = None
+        self._queued = False
+        if self._fading is not None:
+            self._fading = None
+            self._stop_fades()
+        
+        # Stopping the old track shouldn't count as its end.
+        if self._endevent is not None:
+            pygame.mixer.music.set_endevent()
+        pygame.mixer.music.load(record.loc)
         # Can take a start time from the music's metadata!
-        pygame.mixer.music.play(0, float(loaders[ext](f).get('gstart', [0])[0]))
+        pygame.mixer.music.play(0, record.gstart)
+        if self._endevent is not None:
+            pygame.mixer.music.set_endevent(self._endevent)
+            self._prefetch()
+    
+    def track_finished(self):
+        '''
+        Go on to the next track. Call this when a track ends, unless 
+        bind_music() has been used.
+        '''
+        if self._queued:
+            # Already playing, without a gap.
+            self._upcoming = None
+            self._queued = False
+            self._prefetch()
+        elif self._upcoming is not None:
+            self.play_song(self._upcoming)
+        else:
+            self.next_song()
+    
+    def bind_music(self, eman):
+        '''
+        Handle the ends of tracks through EventManager() @eman, and play 
+        tracks without gaps by queueing each one before the last ends. This 
+        uses MUSICEVENT as the mixer's end event, and WARMEVENT.
+        '''
+        eman.bind(self._music_cb, MUSICEVENT)
+        eman.bind(self._warm_cb, WARMEVENT)
+        self._endevent = MUSICEVENT
+        pygame.mixer.music.set_endevent(MUSICEVENT)
+        if self.crossfade:
+            eman.bind(self._fade_cb, FADEEVENT)
+    
+    def _prefetch(self):
+        '''
+        Used internally to pick the next track and read it in the background.
+        '''
+        if self.playlist is None:
+            return
+        self._upcoming = self.playlist.next()
+        t = threading.Thread(target=self._warm, 
+                args=(self._upcoming, self._generation))
+        t.daemon = True
+        t.start()
+    
+    def _warm(self, record, generation):
+        '''
+        Used internally, on a separate thread, to get @record into the page 
+        cache and read its start time, so that queueing it doesn't stall.
+        '''
+        try:
+            with open(record.loc, 'rb') as f:
+                while f.read(1 << 16):
+                    pass
+            record.gstart
+        except Exception:
+            # play_song() will run into it again and complain properly.
+            pass
+        # Events below USEREVENT can't carry attributes in Pygame 2.
+        self._warmed.append((record, generation))
+        pygame.event.post(pygame.event.Event(WARMEVENT))
+    
+    def _music_cb(self, eman, gstate, event):
+        '''
+        Used internally to handle MUSICEVENT.
+        '''
+        self.track_finished()
+    
+    def _warm_cb(self, eman, gstate, event):
+        '''
+        Used internally to handle WARMEVENT, by queueing the next track if it 
+        is still coming up.
+        '''
+        while self._warmed:
+            record, generation = self._warmed.pop(0)
+            if (generation == self._generation and record is self._upcoming 
+                    and not self._queued and not record.gstart):
+                pygame.mixer.music.queue(record.loc)
+                self._queued = True
+        while self._decoded:
+            record, generation, sound = self._decoded.pop(0)
+            if generation != self._generation:
+                continue
+            if sound is None:
+                # Couldn't decode it; just cut over.
+                self.play_song(record)
+                continue
+            if self._fading is not None:
+                # The playing track is on the fading channel; fade it out 
+                # on its own, and bring the new one in on the other.
+                old = self._fade_channel
+                old.set_endevent()
+                old.fadeout(self.crossfade)
+                self._fade_channel = self._spare_channel
+                self._spare_channel = old
+            self._fading = record
+            sound.set_volume(self.m_vol)
+            # Only the end of the new track may post FADEEVENT.
+            self._fade_channel.set_endevent()
+            self._fade_channel.play(sound, fade_ms=self.crossfade)
+            self._fade_channel.set_endevent(FADEEVENT)
+            # Fading out drops anything queued, and isn't a track ending.
+            pygame.mixer.music.set_endevent()
+            pygame.mixer.music.fadeout(self.crossfade)
+    
+    def _crossfade_to(self, record):
+        '''
+        Used internally to start decoding @record, to crossfade to it once 
+        that is done. Doesn't block.
+        '''
+        self._generation += 1
+        self._upcoming = None
+        self._queued = False
+        # The mixer can't unqueue the old playlist's next track, but its end 
+        # mustn't start the new playlist before the crossfade can.
+        pygame.mixer.music.set_endevent()
+        t = threading.Thread(target=self._decode, 
+                args=(record, self._generation))
+        t.daemon = True
+        t.start()
+    
+    def _decode(self, record, generation):
+        '''
+        Used internally, on a separate thread, to decode @record into a Sound.
+        '''
+        try:
+            sound = pygame.mixer.Sound(record.loc)
+        except Exception:
+            sound = None
+        self._decoded.append((record, generation, sound))
+        pygame.event.post(pygame.event.Event(WARMEVENT))
+    
+    def _fade_cb(self, eman, gstate, event):
+        '''
+        Used internally to handle FADEEVENT, by handing playback back to the 
+        music stream.
+        '''
+        # A FADEEVENT posted before the current crossfade started is stale.
+        if self._fading is not None and not self._fade_channel.get_busy():
+            self._fading = None
+            self.next_song()
+    
+    def _stop_fades(self):
+        '''
+        Used internally to silence both crossfading channels, without any 
+        FADEEVENT being posted for them.
+        '''
+        for channel in (self._fade_channel, self._spare_channel):
+            channel.set_endevent()
+            channel.stop()
     
     ### Change volumes
     
@@ -281,6 +556,10 @@ class Resources(object):
                 vol += self.m_vol
             self.m_vol = min(max(vol, 0), 1)
         pygame.mixer.music.set_volume(self.m_vol)
+        if self._fading is not None:
+            sound = self._fade_channel.get_sound()
+            if sound is not None:
+                sound.set_volume(self.m_vol)
     
     def set_s_vol(self, vol=None, relative=False):
         '''
@@ -313,6 +592,45 @@ class Resources(object):
         '''
         return self.code[title.lower()]
     
+    def image_handle(self, title, group):
+        '''
+        Get a Handle() for image @title from group @group.
+        '''
+        group, title = group.lower(), title.lower()
+        return self._get_handle(T_IMAGE, group, title, 
+                self.images.get(group, {}).get(title))
+    def sound_handle(self, title, group):
+        '''
+        Get a Handle() for sound @title from group @group.
+        '''
+        group, title = group.lower(), title.lower()
+        return self._get_handle(T_SOUND, group, title, 
+                self.sounds.get(group, {}).get(title))
+    def code_handle(self, title):
+        '''
+        Get a Handle() for code object @title.
+        '''
+        title = title.lower()
+        return self._get_handle(T_CODE, None, title, self.code.get(title))
+    
+    def _get_handle(self, ty, group, title, value):
+        '''
+        Used internally to get or make the Handle() of a resource.
+        '''
+        key = (ty, group, title)
+        if key not in self._handles:
+            self._handles[key] = Handle(value)
+        return self._handles[key]
+    
+    def _update_handle(self, ty, group, title, value):
+        '''
+        Used internally to point the Handle() of a resource, if it has one, 
+        at a newly loaded @value.
+        '''
+        handle = self._handles.get((ty, group, title))
+        if handle is not None:
+            handle.value = value
+    
     def get_channel(self):
         '''
         Used internally when playing sounds.
@@ -363,6 +681,14 @@ class EventManager(object):
     '''
     An event manager for complex applications with a necessity for run-time 
     customizable event handling.
+    
+    Handlers are called in order of priority, highest first; handlers of 
+    the same priority are called in the order they were bound. A handler can 
+    return STOP to keep the rest from seeing the event.
+    
+    apply_filter() tells SDL to only queue the event types that have 
+    handlers, so that the rest never reach Python. While filtering, the 
+    filter is kept up to date by bind() and unbind().
     '''
     class Message(Exception):
         pass
@@ -385,19 +711,28 @@ class EventManager(object):
         '''
         self.gstate = gstate
         self.event_funcs = {}
+        # Negated priorities, in step with event_funcs, for bisect
+        self._priorities = {}
+        self.filtering = False
     
     ### Event registering
     
-    def bind(self, func, etype):
+    def bind(self, func, etype, priority=0):
         '''
         Register @func for execution when events with `.type` of @etype 
         or meta-events with `.utype` of @etype are handled. @func will be 
-        called with self, self.gstate, and the event as arguments.
+        called with self, self.gstate, and the event as arguments, before any 
+        function of a lower @priority.
         '''
-        self.event_funcs.setdefault(etype, [])
+        funcs = self.event_funcs.setdefault(etype, [])
+        keys = self._priorities.setdefault(etype, [])
         # Don't add multiple times!
-        if func not in self.event_funcs[etype]:
-            self.event_funcs[etype].append(func)
+        if func not in funcs:
+            i = bisect.bisect_right(keys, -priority)
+            funcs.insert(i, func)
+            keys.insert(i, -priority)
+            if self.filtering and len(funcs) == 1:
+                self.apply_filter()
     
     def unbind(self, func, etype):
         '''
@@ -407,6 +742,46 @@ class EventManager(object):
         '''
         i= self.event_funcs[etype].index(func)
         del self.event_funcs[etype][i]
+        del self._priorities[etype][i]
+        if self.filtering and not self.event_funcs[etype]:
+            self.apply_filter()
+    
+    ### Event filtering
+    
+    def get_handled_types(self):
+        '''
+        Get the set of event types that have handlers. QUIT and METAEVENT are 
+        always included. Meta-event types can't be told apart from real ones, 
+        so they are included too when they are in range. With KEYDOWN comes 
+        TEXTINPUT, where Pygame 2 gets the `.unicode` of KEYDOWN from.
+        '''
+        types = set([pygame.QUIT, METAEVENT])
+        for etype, funcs in self.event_funcs.items():
+            if funcs and 0 <= etype < pygame.NUMEVENTS:
+                types.add(etype)
+        if pygame.KEYDOWN in types and hasattr(pygame, 'TEXTINPUT'):
+            types.add(pygame.TEXTINPUT)
+        return types
+    
+    def apply_filter(self):
+        '''
+        Block all event types but those from get_handled_types(), and keep 
+        the filter up to date from now on. Without an initialized display, 
+        SDL is left alone until the next update.
+        '''
+        self.filtering = True
+        if not pygame.display.get_init():
+            return
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(sorted(self.get_handled_types()))
+    
+    def remove_filter(self):
+        '''
+        Let all event types through again.
+        '''
+        self.filtering = False
+        if pygame.display.get_init():
+            pygame.event.set_allowed(None)
     
     ### pygw.Container() compatibility methods
     
@@ -447,8 +822,10 @@ class EventManager(object):
             for e in events:
                 if e.type == METAEVENT:
                     e = self.MetaEvent(e)
-                for func in self.event_funcs.get(e.type, []):
-                    func(self, self.gstate, e)
+                # A copy, as handlers may bind and unbind
+                for func in tuple(self.event_funcs.get(e.type, ())):
+                    if func(self, self.gstate, e) is STOP:
+                        break
         except self.Message as e:
             return e.message
 
@@ -456,23 +833,51 @@ class EventManager(object):
 class HotspotManager(object):
     '''
     An addon to EventManager that allows dynamic mouse-action-in-area binding.
+    
+    add_static() and add_dynamic() return a handle that can be passed to 
+    remove(). Bound methods are only held weakly, and their hotspots go away 
+    by themselves when their objects are garbage collected.
+    
+    Hotspots are visited from the top down, as given by their @z keys; a 
+    button_action_func can return STOP to keep the hotspots underneath from 
+    seeing the click, and only the top-most hotspot under the mouse is told 
+    that it is hovered. Call restack() when the keys change.
+    
+    The mouse events are only bound while there are hotspots, so that an 
+    EventManager() filtering events doesn't let them through for nothing.
     '''
     def __init__(self, emanager):
-        self.dynamic = []
-        self.static = []
-        emanager.bind(self.execute, pygame.MOUSEBUTTONDOWN)
-        emanager.bind(self.execute, pygame.MOUSEBUTTONUP)
-        emanager.bind(self.exec_hover, pygame.MOUSEMOTION)
+        self.dynamic = OrderedDict()
+        self.static = OrderedDict()
+        self.z = {}
+        self._order = None
+        self._handles = itertools.count()
+        self._bound = False
         self.emanager = emanager
     
     def __del__(self):
-        self.emanager.unbind(self.execute, pygame.MOUSEBUTTONDOWN)
-        self.emanager.unbind(self.execute, pygame.MOUSEBUTTONUP)
-        self.emanager.unbind(self.exec_hover, pygame.MOUSEMOTION)
+        self._set_bound(False)
+    
+    def _set_bound(self, bound):
+        '''
+        Used internally to bind or unbind the mouse events.
+        '''
+        if bound == self._bound:
+            return
+        self._bound = bound
+        # Ahead of ordinary handlers, as when bound at creation
+        if bound:
+            self.emanager.bind(self.execute, pygame.MOUSEBUTTONDOWN, 1)
+            self.emanager.bind(self.execute, pygame.MOUSEBUTTONUP, 1)
+            self.emanager.bind(self.exec_hover, pygame.MOUSEMOTION, 1)
+        else:
+            self.emanager.unbind(self.execute, pygame.MOUSEBUTTONDOWN)
+            self.emanager.unbind(self.execute, pygame.MOUSEBUTTONUP)
+            self.emanager.unbind(self.exec_hover, pygame.MOUSEMOTION)
     
     ### Event registration
     
-    def add_static(self, cfuncs, rect, absolute=True):
+    def add_static(self, cfuncs, rect, absolute=True, z=None):
         '''
         @cfuncs is a (button_action_func, hover_func) tuple. button_action_func 
         should have a 
@@ -482,11 +887,17 @@ class HotspotManager(object):
         signature.
         
         Adds @cfuncs statically; that is, it will be called whenever the 
-        mouse is clicked inside @rect.
+        mouse is clicked inside @rect. Returns a handle for remove().
+        
+        @z is a function returning the stacking key of the hotspot; higher 
+        keys are on top. Without it, the hotspot is below all that have one.
         '''
-        self.static.append((cfuncs, rect))
+        handle = next(self._handles)
+        self.static[handle] = (self._weaken(cfuncs, handle), rect)
+        self._add_z(handle, z)
+        return handle
     
-    def add_dynamic(self, cfuncs, rfunc):
+    def add_dynamic(self, cfuncs, rfunc, z=None):
         '''
         @cfuncs is a (button_action_func, hover_func) tuple. button_action_func 
         should have a 
@@ -496,60 +907,273 @@ class HotspotManager(object):
         signature.
         
         Adds @cfuncs dynamically; that is, it will be called whenever the 
-        mouse is clicked inside any of the Rect()s provided by @rfunc.
+        mouse is clicked inside any of the Rect()s provided by @rfunc. Returns 
+        a handle for remove(). See add_static() for @z.
+        '''
+        handle = next(self._handles)
+        self.dynamic[handle] = (self._weaken(cfuncs, handle), 
+                self._weaken((rfunc,), handle)[0])
+        self._add_z(handle, z)
+        return handle
+    
+    def remove(self, handle):
+        '''
+        Remove the hotspot that @handle was returned for. Does nothing if it 
+        is already gone.
+        '''
+        self.static.pop(handle, None)
+        self.dynamic.pop(handle, None)
+        self.z.pop(handle, None)
+        self._order = None
+        if not self.z:
+            self._set_bound(False)
+    
+    def restack(self):
+        '''
+        Drop the cached stacking order, after the @z keys have changed.
+        '''
+        self._order = None
+    
+    def _add_z(self, handle, z):
+        '''
+        Used internally to record the stacking key function of @handle.
+        '''
+        self.z[handle] = self._weaken((z,), handle)[0]
+        self._order = None
+        self._set_bound(True)
+    
+    def get_order(self):
+        '''
+        Get the handles of all hotspots, top-most first.
+        '''
+        if self._order is None:
+            keys = {}
+            for handle, z in self.z.items():
+                key = z() if z is not None else None
+                # Keyless hotspots go underneath the rest.
+                keys[handle] = (key is not None, key or (), handle)
+            self._order = sorted(keys, key=keys.get, reverse=True)
+        return self._order
+    
+    def _weaken(self, funcs, handle):
+        '''
+        Used internally to hold @funcs weakly; the hotspot of @handle is 
+        removed when any of them dies.
         '''
-        self.dynamic.append((cfuncs, rfunc))
+        cb = lambda wc: self.remove(handle)
+        return tuple(weak_callable(f, cb) for f in funcs)
     
     ### Event handling
     
+    def _hit(self, handle, gstate, loc):
+        '''
+        Used internally to get the callbacks of @handle, and whether @loc is 
+        inside of it. Returns None for removed hotspots.
+        '''
+        if handle in self.static:
+            cfuncs, rect = self.static[handle]
+            return cfuncs, rect.collidepoint(loc)
+        if handle in self.dynamic:
+            cfuncs, rfunc = self.dynamic[handle]
+            for r in rfunc(gstate) or ():
+                if r.collidepoint(loc):
+                    return cfuncs, True
+            return cfuncs, False
+    
     def execute(self, eman, gstate, event):
         loc = event.pos
-        for t in self.static:
-            if t[0][0] is None:
-                continue
-            if t[1].collidepoint(loc):
-                t[0][0](eman, gstate, event)
-        for t in self.dynamic:
-            if t[0][0] is None:
+        # A copy, as dying objects may remove their hotspots at any time
+        for handle in tuple(self.get_order()):
+            t = self._hit(handle, gstate, loc)
+            if t is None or t[0][0] is None or not t[1]:
                 continue
-            for r in t[1](gstate):
-                if r.collidepoint(loc):
-                    t[0][0](eman, gstate, event)
-                    break
+            if t[0][0](eman, gstate, event) is STOP:
+                break
     
     def exec_hover(self, eman, gstate, event):
         loc = event.pos
-        for t in self.static:
-            if t[0][1] is None:
+        hovered = False
+        for handle in tuple(self.get_order()):
+            t = self._hit(handle, gstate, loc)
+            if t is None or t[0][1] is None:
                 continue
-            t[0][1](eman, gstate, event, t[1].collidepoint(loc))
-        for t in self.dynamic:
-            if t[0][1] is None:
-                continue
-            for r in t[1](gstate):
-                y = False
-                if r.collidepoint(loc):
-                    y = True
-                    break
+            y = t[1] and not hovered
+            hovered = hovered or t[1]
             t[0][1](eman, gstate, event, y)
 
 
+class FocusManager(object):
+    '''
+    An addon to EventManager that routes keyboard events to a single focused 
+    target, instead of to everything that might want to be typed in.
+    
+    Targets must have a 
+    type_cb(EventManager, GameState, Event) 
+    method, which receives the KEYDOWN events while the target is focused, a 
+    click_cb(EventManager, GameState, Event) 
+    method, which receives the MOUSEBUTTONDOWN events while the target is 
+    focused (to allow it to give up the focus), and a 
+    set_focus(bool: "Is target focused?") 
+    method. They may also have a can_focus() method, returning whether the 
+    target can take the focus at the moment.
+    
+    The Tab key moves the focus through the targets in `.targets` order 
+    (backwards with Shift) unless `.tab_keys` is False.
+    
+    Targets are only held weakly, and drop out of the tab order by themselves 
+    when they are garbage collected.
+    
+    As with HotspotManager(), the events are only bound while there are 
+    targets, so that an EventManager() filtering events can leave them out.
+    '''
+    def __init__(self, emanager):
+        self._targets = []
+        self._focused = None
+        self._bound = False
+        self.tab_keys = True
+        self.emanager = emanager
+    
+    def __del__(self):
+        self._set_bound(False)
+    
+    def _set_bound(self, bound):
+        '''
+        Used internally to bind or unbind the keyboard and mouse events.
+        '''
+        if bound == self._bound:
+            return
+        self._bound = bound
+        # Ahead of ordinary handlers, as when bound at creation
+        if bound:
+            self.emanager.bind(self.execute, pygame.KEYDOWN, 1)
+            self.emanager.bind(self.exec_click, pygame.MOUSEBUTTONDOWN, 1)
+        else:
+            self.emanager.unbind(self.execute, pygame.KEYDOWN)
+            self.emanager.unbind(self.exec_click, pygame.MOUSEBUTTONDOWN)
+    
+    ### Target registration
+    
+    def get_targets(self):
+        '''
+        Get the live targets, in tab order.
+        '''
+        return [t for t in (r() for r in self._targets) if t is not None]
+    targets = property(get_targets)
+    
+    def get_focused(self):
+        '''
+        Get the focused target, or None.
+        '''
+        return self._focused() if self._focused is not None else None
+    focused = property(get_focused)
+    
+    def add(self, target):
+        '''
+        Add @target to the end of the tab order.
+        '''
+        if target not in self.targets:
+            self._targets.append(weakref.ref(target, self._prune))
+            self._set_bound(True)
+    
+    def remove(self, target):
+        '''
+        Remove @target, taking the focus away from it if needed.
+        '''
+        if target is self.focused:
+            self.blur()
+        self._targets = [r for r in self._targets if r() is not target]
+        if not self._targets:
+            self._set_bound(False)
+    
+    def _prune(self, ref):
+        '''
+        Used internally to drop the reference @ref of a collected target.
+        '''
+        if ref in self._targets:
+            self._targets.remove(ref)
+        if not self._targets:
+            self._set_bound(False)
+    
+    ### Focus control
+    
+    def focus(self, target):
+        '''
+        Give the focus to @target, or to nothing if @target is None.
+        '''
+        if target is self.focused:
+            return
+        old = self.focused
+        self._focused = weakref.ref(target) if target is not None else None
+        if old is not None:
+            old.set_focus(False)
+        if target is not None:
+            target.set_focus(True)
+    
+    def blur(self):
+        '''
+        Take the focus away from the focused target.
+        '''
+        self.focus(None)
+    
+    def focus_next(self, reverse=False):
+        '''
+        Move the focus to the next target in the tab order that can take it, 
+        or to the previous one if @reverse is True.
+        '''
+        targets = self.targets
+        n = len(targets)
+        if not n:
+            return
+        step = -1 if reverse else 1
+        focused = self.focused
+        if focused in targets:
+            i = targets.index(focused)
+        else:
+            i = -1 if not reverse else n
+        for j in range(1, n + 1):
+            t = targets[(i + step * j) % n]
+            if getattr(t, 'can_focus', lambda: True)():
+                self.focus(t)
+                return
+    
+    ### Event handling
+    
+    def execute(self, eman, gstate, event):
+        focused = self.focused
+        if event.key == pygame.K_TAB and self.tab_keys:
+            self.focus_next(event.mod & pygame.KMOD_SHIFT)
+        elif focused is not None:
+            focused.type_cb(eman, gstate, event)
+    
+    def exec_click(self, eman, gstate, event):
+        focused = self.focused
+        if focused is not None:
+            focused.click_cb(eman, gstate, event)
+
+
 class EventManagerPlus(EventManager):
     '''
-    A version of EventManager with a builtin HotspotManager.
+    A version of EventManager with a builtin HotspotManager and FocusManager.
     '''
     def __init__(self, gstate):
         EventManager.__init__(self, gstate)
         self.hotspot = HotspotManager(self)
+        self.focus_manager = FocusManager(self)
 
 
 class StateManager(GameState):
     '''
     A GameState with a state model. Each state has an EventManagerPlus for 
     separation of events.
+    
+    With @filter_events, the EventManager of the current state filters the 
+    events (see EventManager.apply_filter()), so that only event types with 
+    handlers in that state are queued.
     '''
-    def __init__(self, states, groups={}):
+    def __init__(self, states, groups={}, filter_events=False):
         self.states = {}
+        self.filter_events = filter_events
+        self._state = None
         self.add_states(*states)
         self.state = states[0]
         GameState.__init__(self, groups)
@@ -580,6 +1204,10 @@ class StateManager(GameState):
         '''
         Set the state to @state.
         '''
+        if self.filter_events:
+            if self._state is not None:
+                self.states[self._state].filtering = False
+            self.states[state].apply_filter()
         self._state = state
     state = property(get_state, set_state)
     
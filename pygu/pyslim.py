@@ -22,12 +22,46 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 __version__ = '1.0.2'
-__all__ = ['load']
+__all__ = ['load', 'benchmark', 'read_tags', 'scan', 'LibraryIndex', 
+        'save_many']
 
+import io
+import os
+import json
+import shutil
+import struct
+import tempfile
+import threading
 import importlib
 
+from timeit import default_timer
+from contextlib import contextmanager
+
+from common import get_ext
+
+try:
+    from importlib.util import find_spec
+except ImportError:
+    import imp
+    def find_spec(name):
+        try:
+            imp.find_module(name)
+            return True
+        except ImportError:
+            return None
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
 loaders = []
 ldict = {}
+# Types whose loader benchmark() has picked already
+_benchmarked = set()
+# Bounds how many files the loaders may hold open at once, which matters 
+# most on the threads of save_many().
+_handles = threading.BoundedSemaphore(32)
 
 
 def load(filename, default=None):
@@ -42,15 +76,553 @@ def load(filename, default=None):
         return default
 
 
-def _loader(d):
-    res = {}
+def benchmark(samples, runs=3):
+    '''
+    Time the loaders of the type of each file in @samples on it, and have 
+    load() use the fastest from then on. Only writable loaders that give the 
+    same keys for the sample as the one load() uses already are compared, so 
+    the keys load() returns don't change. Each type is benchmarked once per 
+    process; scan() passes the choices on to its workers. Returns a {ext: 
+    loader} dict of the choices made.
+    
+    This is opt-in, as every type costs (1 + @runs) loads per loader.
+    '''
+    chosen = {}
+    for filename in samples:
+        ext = get_ext(filename)
+        if ext not in ldict or ext in _benchmarked:
+            continue
+        _benchmarked.add(ext)
+        try:
+            keys = set(ldict[ext](filename).keys())
+        except Exception:
+            continue
+        best = None
+        for cls in loaders:
+            if not cls.writable or ext not in cls.file_mapping:
+                continue
+            try:
+                # Untimed, so that importing the backend doesn't count
+                if set(cls(filename).keys()) != keys:
+                    continue
+                t = default_timer()
+                for i in range(runs):
+                    cls(filename)
+                t = default_timer() - t
+            except Exception:
+                continue
+            if best is None or t < best[0]:
+                best = (t, cls)
+        if best is not None:
+            ldict[ext] = chosen[ext] = best[1]
+    return chosen
+
+
+@contextmanager
+def _open(filename, mode='rb'):
+    '''
+    Used internally to open @filename for a backend, waiting for a slot in 
+    the handle pool first, and close it again afterwards.
+    '''
+    with _handles:
+        with open(filename, mode) as f:
+            yield f
+
+
+### Native header-only tag reading
+
+class _ChunkReader(object):
+    '''
+    Used internally to read from an iterable of byte strings like a file.
+    '''
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buf = b''
+    
+    def read(self, n):
+        while len(self.buf) < n:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buf += chunk
+        data, self.buf = self.buf[:n], self.buf[n:]
+        return data
+
+
+def _ogg_packet(f, index):
+    '''
+    Used internally to yield the data of packet @index of Ogg file @f, one 
+    piece per page, without reading the packets before it.
+    '''
+    packet = 0
+    while True:
+        header = f.read(27)
+        if len(header) < 27 or header[:4] != b'OggS':
+            return
+        size = 0
+        for lace in bytearray(f.read(bytearray(header)[26])):
+            size += lace
+            if lace < 255:
+                # A packet ends here.
+                if packet == index:
+                    yield f.read(size)
+                    return
+                f.seek(size, 1)
+                size = 0
+                packet += 1
+        # What is left goes on in the next page.
+        if packet == index:
+            yield f.read(size)
+        else:
+            f.seek(size, 1)
+
+
+def _vorbis_comments(r, keys, tags):
+    '''
+    Used internally to read a Vorbis comment block from @r into @tags, 
+    stopping once all of @keys (all keys, if None) have been found.
+    '''
+    unpack = lambda: struct.unpack('<I', r.read(4))[0]
+    # The vendor string
+    r.read(unpack())
+    for i in range(unpack()):
+        key, eq, value = r.read(unpack()).partition(b'=')
+        key = key.decode('ascii', 'replace').lower()
+        if keys is None or key in keys:
+            tags.setdefault(key, []).append(value.decode('utf-8', 'replace'))
+            if keys is not None and keys.issubset(tags):
+                return
+
+
+def _read_ogg(f, keys, tags):
+    '''
+    Used internally to read the comments of an Ogg Vorbis or Opus file.
+    '''
+    # The comments are the second packet.
+    r = _ChunkReader(_ogg_packet(f, 1))
+    head = r.read(7)
+    if head == b'\x03vorbis' or head + r.read(1) == b'OpusTags':
+        _vorbis_comments(r, keys, tags)
+
+
+def _read_flac(f, keys, tags):
+    '''
+    Used internally to read the comments of a FLAC file.
+    '''
+    if f.read(4) != b'fLaC':
+        return
+    last = False
+    while not last:
+        header = bytearray(f.read(4))
+        if len(header) < 4:
+            return
+        last = header[0] & 0x80
+        size = struct.unpack('>I', b'\0' + bytes(header[1:]))[0]
+        if header[0] & 0x7f == 4:
+            _vorbis_comments(f, keys, tags)
+            return
+        f.seek(size, 1)
+
+
+def _synchsafe(data):
+    n = 0
+    for b in bytearray(data):
+        n = (n << 7) | (b & 0x7f)
+    return n
+
+
+_id3_encodings = ['latin-1', 'utf-16', 'utf-16-be', 'utf-8']
+
+def _read_id3(f, keys, tags):
+    '''
+    Used internally to read the TXXX frames of an ID3v2 tag, keyed by their 
+    descriptions, as written by most taggers for custom keys.
+    '''
+    header = bytearray(f.read(10))
+    if len(header) < 10 or header[:3] != b'ID3' or header[3] > 4:
+        return
+    version, flags = header[3], header[5]
+    left = _synchsafe(header[6:])
+    if flags & 0x80 and version < 4:
+        # Unsynchronised as a whole; undo it in memory.
+        f = io.BytesIO(f.read(left).replace(b'\xff\x00', b'\xff'))
+    if flags & 0x40:
+        # Skip the extended header.
+        if version == 3:
+            size = struct.unpack('>I', f.read(4))[0]
+            f.seek(size, 1)
+            left -= 4 + size
+        else:
+            size = _synchsafe(f.read(4))
+            f.seek(size - 4, 1)
+            left -= size
+    
+    hsize, idsize = (6, 3) if version == 2 else (10, 4)
+    txxx = b'TXXX'[:idsize]
+    while left >= hsize:
+        fh = bytearray(f.read(hsize))
+        if len(fh) < hsize or not fh[0]:
+            # Padding
+            return
+        if version == 2:
+            size = struct.unpack('>I', b'\0' + bytes(fh[3:6]))[0]
+        elif version == 3:
+            size = struct.unpack('>I', bytes(fh[4:8]))[0]
+        else:
+            size = _synchsafe(fh[4:8])
+        left -= hsize + size
+        if bytes(fh[:idsize]) != txxx:
+            f.seek(size, 1)
+            continue
+        
+        body = f.read(size)
+        fflags = fh[9] if version > 2 else 0
+        if version == 3:
+            if fflags & 0xc0:
+                # Compressed or encrypted
+                continue
+            if fflags & 0x20:
+                body = body[1:]
+        elif version == 4:
+            if fflags & 0x0c:
+                continue
+            if fflags & 0x02:
+                body = body.replace(b'\xff\x00', b'\xff')
+            if fflags & 0x01:
+                body = body[4:]
+        if not body or bytearray(body)[0] > 3:
+            continue
+        text = body[1:].decode(_id3_encodings[bytearray(body)[0]], 'replace')
+        parts = [p.lstrip(u'\ufeff') for p in text.split(u'\x00')]
+        key = parts[0].lower()
+        if keys is None or key in keys:
+            tags.setdefault(key, []).extend(p for p in parts[1:] if p)
+            if keys is not None and keys.issubset(tags):
+                return
+
+
+_native = {
+        'ogg': _read_ogg, 
+        'oga': _read_ogg, 
+        'opus': _read_ogg, 
+        'flac': _read_flac, 
+        'mp3': _read_id3}
+
+
+def read_tags(filename, keys=None):
+    '''
+    Read the tags of @filename as a {key: [value, ...]} dict with lowercase 
+    keys, or just those in @keys. Ogg Vorbis, Opus, FLAC and the custom 
+    (TXXX) tags of MP3 are read natively, from the headers alone and only up 
+    to the last key wanted; other types go through the backends. Unreadable 
+    files give what could be read, if anything.
+    '''
+    if keys is not None:
+        keys = set(k.lower() for k in keys)
+    reader = _native.get(get_ext(filename))
+    if reader is None:
+        tags = _read_tags(filename)[1] or {}
+        return tags if keys is None else dict(
+                (k, v) for k, v in tags.items() if k in keys)
+    tags = {}
     try:
-        for k in d:
-            mod, attr = d[k].rsplit('.', 1)
-            res[k] = getattr(importlib.import_module(mod), attr)
-            ldict.setdefault(k, res[k])
-    except ImportError:
+        with open(filename, 'rb') as f:
+            reader(f, keys, tags)
+    except (IOError, OSError, struct.error, ValueError):
         pass
+    return tags
+
+
+### Bulk scanning
+
+def _use_loaders(choices):
+    '''
+    Used internally, to start the worker processes of scan() with the 
+    loaders of the parent process, @choices being its ldict.
+    '''
+    ldict.update(choices)
+
+
+def _read_tags(filename):
+    '''
+    Used internally, in the worker processes of scan(), to read the tags of 
+    @filename as a {key: [value, ...]} dict of strings. Returns a (@filename, 
+    tags) tuple, with None for the tags on failure.
+    '''
+    try:
+        obj = load(filename)
+        if obj is None:
+            return filename, None
+        tags = {}
+        for k, v in obj.items():
+            if not isinstance(v, (list, tuple)):
+                v = [v]
+            tags[text_type(k).lower()] = [text_type(x) for x in v]
+        return filename, tags
+    except Exception:
+        return filename, None
+
+
+class LibraryIndex(object):
+    '''
+    A persistent index of the tags of a music library, as built by scan(). 
+    Entries are kept by path, along with the mtime their tags were read at, 
+    so that scanning again only reads files that changed. Indices are saved 
+    as JSON.
+    '''
+    def __init__(self, path=None):
+        '''
+        @path is the file to load the index from and save it to. The index 
+        starts out empty if @path is None or doesn't exist yet.
+        '''
+        self.path = path
+        self.entries = {}
+        self._by_tag = None
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)['entries']
+    
+    def __len__(self):
+        return len(self.entries)
+    def __contains__(self, filename):
+        return filename in self.entries
+    def __iter__(self):
+        return iter(self.entries)
+    
+    def save(self, path=None):
+        '''
+        Save the index to @path, or to the path it was loaded from.
+        '''
+        path = path or self.path
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': __version__, 'entries': self.entries}, f)
+        # Never leave a half-written index behind.
+        getattr(os, 'replace', os.rename)(tmp, path)
+    
+    def get(self, filename, default=None):
+        '''
+        Get the tags of @filename, or @default if it isn't indexed.
+        '''
+        entry = self.entries.get(filename)
+        return default if entry is None else entry['tags']
+    
+    def is_current(self, filename, mtime):
+        '''
+        Check whether @filename is indexed as of @mtime.
+        '''
+        entry = self.entries.get(filename)
+        return entry is not None and entry['mtime'] == mtime
+    
+    def set(self, filename, mtime, tags):
+        self.entries[filename] = {'mtime': mtime, 'tags': tags}
+        self._by_tag = None
+    
+    def remove(self, filename):
+        self.entries.pop(filename, None)
+        self._by_tag = None
+    
+    def query(self, **tags):
+        '''
+        Get a sorted list of the files whose tags have all of the given 
+        values, as in `index.query(artist='Foo', album='Bar')`. Tag names are 
+        case-insensitive.
+        '''
+        if self._by_tag is None:
+            # Built on first use, then each query is a few set lookups.
+            self._by_tag = {}
+            for filename, entry in self.entries.items():
+                for k, values in entry['tags'].items():
+                    for v in values:
+                        self._by_tag.setdefault((k, v), set()).add(filename)
+        res = None
+        for k, v in tags.items():
+            found = self._by_tag.get((k.lower(), text_type(v)), set())
+            res = found if res is None else res & found
+        return sorted(self.entries if res is None else res)
+
+
+def scan(dirs, index=None, workers=None, chunksize=16):
+    '''
+    Read the tags of every file with a loader under each dir in @dirs into 
+    LibraryIndex() @index (a new one if None), which is returned. Files that 
+    are indexed as of their current mtime are skipped, and indexed files 
+    under @dirs that are gone are dropped. The tags are read by a pool of 
+    @workers processes (one per CPU if None); @chunksize files are sent to a 
+    worker at a time.
+    '''
+    if index is None:
+        index = LibraryIndex()
+    found = set()
+    todo = []
+    mtimes = {}
+    for d in dirs:
+        root = os.path.abspath(d)
+        for dirpath, dirnames, filenames in os.walk(root):
+            for fl in filenames:
+                full = os.path.join(dirpath, fl)
+                if get_ext(fl) not in ldict:
+                    continue
+                try:
+                    mtime = os.path.getmtime(full)
+                except OSError:
+                    continue
+                found.add(full)
+                if not index.is_current(full, mtime):
+                    todo.append(full)
+                    mtimes[full] = mtime
+        prefix = os.path.join(root, '')
+        for filename in list(index):
+            if filename.startswith(prefix) and filename not in found:
+                index.remove(filename)
+    
+    if workers == 1 or len(todo) <= chunksize:
+        # Not worth starting processes for.
+        results = map(_read_tags, todo)
+        pool = None
+    else:
+        # Imported here, as it is slow to import.
+        import multiprocessing
+        pool = multiprocessing.Pool(workers, _use_loaders, (dict(ldict),))
+        results = pool.imap_unordered(_read_tags, todo, chunksize)
+    try:
+        for filename, tags in results:
+            if tags is not None:
+                index.set(filename, mtimes[filename], tags)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return index
+
+
+### Batch writing
+
+def get_loader(filename):
+    '''
+    Get the first SlimLoader() class that can write the tags of @filename, or 
+    None.
+    '''
+    ext = get_ext(filename)
+    for cls in loaders:
+        if cls.writable and ext in cls.file_mapping:
+            return cls
+
+
+def _save_one(job):
+    '''
+    Used internally, on the threads of save_many(), to apply one file's 
+    updates. Returns a (filename, error) tuple, with None for success.
+    '''
+    filename, tags = job
+    tmp = None
+    try:
+        cls = get_loader(filename)
+        if cls is None:
+            raise ValueError('No loader can write %s' % filename)
+        # Work on a copy with the same extension, so that an error or a 
+        # crash can't leave a half-written file behind.
+        d, name = os.path.split(filename)
+        fd, tmp = tempfile.mkstemp('.' + get_ext(name), '.' + name, d or '.')
+        os.close(fd)
+        shutil.copy2(filename, tmp)
+        obj = cls(tmp)
+        for k, v in tags.items():
+            if v is None:
+                if k in obj:
+                    del obj[k]
+            else:
+                obj[k] = v
+        obj.save()
+        _check_written(tmp, tags)
+        getattr(os, 'replace', os.rename)(tmp, filename)
+        tmp = None
+        return filename, None
+    except Exception as e:
+        return filename, e
+    finally:
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _check_written(filename, tags):
+    '''
+    Used internally to read @tags back from @filename after saving, and raise 
+    an IOError if any of them didn't come out as written.
+    '''
+    written = read_tags(filename, tags.keys())
+    for k, v in tags.items():
+        if v is None:
+            ok = k.lower() not in written
+        else:
+            if not isinstance(v, (list, tuple)):
+                v = [v]
+            ok = written.get(k.lower()) == [text_type(x) for x in v]
+        if not ok:
+            raise IOError('%s did not read back from %s as written' % 
+                    (k, filename))
+
+
+def save_many(updates, workers=4):
+    '''
+    Write tags to many files at once. @updates maps filenames to dicts of 
+    tags to set, where a value of None deletes the tag. Up to @workers files 
+    are written at a time, each to a temporary copy that is read back with 
+    read_tags() and then replaces the original, so every file is either 
+    fully updated or untouched. On MP3 files, tags are written as TXXX 
+    frames. Returns a dict mapping each filename to None on success, or to 
+    the exception that stopped it.
+    '''
+    jobs = list(updates.items())
+    if workers == 1 or len(jobs) < 2:
+        return dict(map(_save_one, jobs))
+    # Imported here, as it is slow to import.
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(workers)
+    try:
+        return dict(pool.imap_unordered(_save_one, jobs))
+    finally:
+        pool.close()
+        pool.join()
+
+
+_available = {}
+
+def _is_available(package):
+    '''
+    Check whether top-level @package can be imported, without importing it.
+    '''
+    if package not in _available:
+        try:
+            _available[package] = find_spec(package) is not None
+        except (ImportError, ValueError):
+            _available[package] = False
+    return _available[package]
+
+
+class _Backend(object):
+    '''
+    Used internally to stand in for a backend callable, given by its dotted 
+    @path, and import it the first time it is called.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.func = None
+    
+    def __call__(self, *args, **kw):
+        if self.func is None:
+            mod, attr = self.path.rsplit('.', 1)
+            self.func = getattr(importlib.import_module(mod), attr)
+        return self.func(*args, **kw)
+
+
+def _loader(d):
+    res = {}
+    for k in d:
+        # Only the top-level package is looked for; finding a submodule 
+        # would import its parents.
+        if _is_available(d[k].split('.', 1)[0]):
+            res[k] = _Backend(d[k])
     return res
 
 
@@ -60,8 +632,11 @@ class BaseSlimLoader(object):
     set based upon mutagen.
     '''
     file_mapping = {}
+    # Whether save() works; read-only loaders are only used for reading.
+    writable = True
     def __init__(self, filename):
-        self.obj = self.file_mapping[get_ext(filename)](filename)
+        with _handles:
+            self.obj = self.file_mapping[get_ext(filename)](filename)
         self.filename = filename
     
     def __iter__(self):
@@ -96,25 +671,248 @@ class BaseSlimLoader(object):
     def update(self, other=None, **kw):
         self.obj.update(other, **kw)
     def save(self):
-        self.obj.save()
+        if not self.writable:
+            raise IOError('%s is read-only' % type(self).__name__)
+        with _handles:
+            self.obj.save()
 
 
 class MutagenLoader(BaseSlimLoader):
-    pass
+    '''
+    The mutagen SlimLoader(). ID3 tags are keyed by frame, so on MP3 files 
+    the TXXX frames are keyed by their descriptions instead, with their text 
+    as the value, as read_tags() reads them. New keys are set as TXXX frames; 
+    other frames keep their frame keys.
+    '''
+    def _is_id3(self):
+        return get_ext(self.filename) == 'mp3'
+    
+    def _frame_key(self, key):
+        '''
+        Used internally to get the ID3 frame key that @key stands for.
+        '''
+        txxx = 'TXXX:' + key
+        if self.obj.tags is not None and txxx in self.obj.tags:
+            return txxx
+        return key
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __getitem__(self, key):
+        if not self._is_id3():
+            return self.obj[key]
+        if self.obj.tags is None:
+            raise KeyError(key)
+        key = self._frame_key(key)
+        frame = self.obj.tags[key]
+        return frame.text if key.startswith('TXXX:') else frame
+    
+    def __setitem__(self, key, value):
+        if self.obj.tags is None:
+            self.obj.add_tags()
+        if not self._is_id3():
+            self.obj[key] = value
+            return
+        # Imported here, as the backend is only imported when first used.
+        from mutagen.id3 import TXXX
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        self.obj.tags.add(TXXX(encoding=3, desc=key, 
+                text=[text_type(v) for v in value]))
+    
+    def __delitem__(self, key):
+        if self._is_id3():
+            key = self._frame_key(key)
+        del self.obj.tags[key]
+    
+    def __contains__(self, key):
+        if self.obj.tags is None:
+            return False
+        if self._is_id3():
+            key = self._frame_key(key)
+        return key in self.obj.tags
+    has_key = __contains__
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def keys(self):
+        return [k for k, v in self.items()]
+    
+    def values(self):
+        return [v for k, v in self.items()]
+    
+    def items(self):
+        if not self._is_id3():
+            return self.obj.items()
+        if self.obj.tags is None:
+            return []
+        return [(k[5:], v.text) if k.startswith('TXXX:') else (k, v) 
+                for k, v in self.obj.tags.items()]
 
 loaders.append(MutagenLoader)
 
 
 class TagPyLoader(BaseSlimLoader):
-    # TODO: Implement!
-    pass
+    '''
+    A SlimLoader() over TagLib. The common tag fields are copied out when the 
+    file is loaded, along with any other keys of a Xiph comment (Ogg, FLAC) 
+    or TXXX frames of an ID3v2 tag (MP3), and written back by save(), so no 
+    file is held open in between.
+    '''
+    fields = ('title', 'artist', 'album', 'comment', 'genre', 'year', 
+            'track')
+    numeric = ('year', 'track')
+    # The Xiph comment keys that TagLib keeps the common fields in
+    xiph_fields = fields + ('description', 'date', 'tracknumber')
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self.obj = {}
+        with _handles:
+            ref = self._open()
+            tag = ref.tag()
+            for k in self.fields:
+                v = getattr(tag, k)
+                if v:
+                    self.obj[k] = v
+            custom = self._read_custom(ref.file())
+        # Kept, so that save() can remove the keys deleted since
+        self._custom = set(custom)
+        self.obj.update(custom)
+    
+    def _open(self):
+        return self.file_mapping[get_ext(self.filename)](self.filename)
+    
+    ### Custom keys
+    
+    def _xiph(self, f):
+        '''
+        Used internally to get the Xiph comment of TagLib file @f, or None.
+        '''
+        if hasattr(f, 'xiphComment'):
+            # FLAC
+            return f.xiphComment(True)
+        tag = f.tag()
+        return tag if hasattr(tag, 'fieldListMap') else None
+    
+    def _id3(self, f):
+        '''
+        Used internally to get the ID3v2 tag of TagLib file @f, or None.
+        '''
+        return f.ID3v2Tag(True) if hasattr(f, 'ID3v2Tag') else None
+    
+    def _read_custom(self, f):
+        '''
+        Used internally to read the keys of TagLib file @f that aren't common 
+        fields, as a {key: [value, ...]} dict.
+        '''
+        res = {}
+        xiph = self._xiph(f)
+        id3 = self._id3(f) if xiph is None else None
+        if xiph is not None:
+            fields = xiph.fieldListMap()
+            for k in fields.keys():
+                if k.lower() not in self.xiph_fields:
+                    res[k.lower()] = list(fields[k])
+        elif id3 is not None:
+            for frame in id3.frameList('TXXX'):
+                # The first field is the description.
+                res[frame.description().lower()] = list(frame.fieldList())[1:]
+        return res
+    
+    def _write_custom(self, f):
+        '''
+        Used internally to write the keys that aren't common fields to TagLib 
+        file @f, and remove the ones deleted since loading.
+        '''
+        keys = [k for k in self.obj if k not in self.fields]
+        gone = self._custom.difference(keys)
+        xiph = self._xiph(f)
+        id3 = self._id3(f) if xiph is None else None
+        if xiph is not None:
+            for k in gone:
+                xiph.removeField(k.upper())
+            for k in keys:
+                values = self.obj[k]
+                if not isinstance(values, (list, tuple)):
+                    values = [values]
+                xiph.removeField(k.upper())
+                for v in values:
+                    xiph.addField(k.upper(), text_type(v), False)
+        elif id3 is not None:
+            # Imported here, as the backend is only imported when first used.
+            from tagpy import StringType
+            from tagpy.id3v2 import UserTextIdentificationFrame
+            for frame in list(id3.frameList('TXXX')):
+                if frame.description().lower() in gone.union(keys):
+                    id3.removeFrame(frame)
+            for k in keys:
+                values = self.obj[k]
+                if not isinstance(values, (list, tuple)):
+                    values = [values]
+                frame = UserTextIdentificationFrame(StringType.UTF8)
+                frame.setDescription(k)
+                frame.setText(u', '.join(text_type(v) for v in values))
+                id3.addFrame(frame)
+        elif keys:
+            raise KeyError(keys[0])
+        self._custom = set(keys)
+    
+    ### Dict interface
+    
+    def __getitem__(self, key):
+        return self.obj[key.lower()]
+    def __delitem__(self, key):
+        del self.obj[key.lower()]
+    def __setitem__(self, key, value):
+        self.obj[key.lower()] = value
+    def __contains__(self, key):
+        return key.lower() in self.obj
+    has_key = __contains__
+    
+    def set(self, key, value):
+        self[key] = value
+    def setdefault(self, key, default=None):
+        if key not in self.obj:
+            self[key] = default
+    def update(self, other=None, **kw):
+        if other:
+            for k in other:
+                self[k] = other[k]
+        for k in kw:
+            self[k] = kw[k]
+    
+    def save(self):
+        with _handles:
+            ref = self._open()
+            tag = ref.tag()
+            for k in self.fields:
+                v = self.obj.get(k)
+                if v is None:
+                    v = 0 if k in self.numeric else u''
+                setattr(tag, k, v)
+            self._write_custom(ref.file())
+            ref.save()
 
 loaders.append(TagPyLoader)
 
 
 class KaaLoader(BaseSlimLoader):
+    '''
+    A read-only SlimLoader() over kaa.metadata, which parses the whole file 
+    up front, so it is closed again straight away.
+    '''
+    writable = False
+    
     def __init__(self, filename):
-        self.obj = self.file_mapping[get_ext(filename)](open(filename, 'rb'))
+        with _open(filename) as f:
+            self.obj = self.file_mapping[get_ext(filename)](f)
+        self.filename = filename
     
     def __iter__(self):
         return iter(self.keys())
@@ -132,6 +930,8 @@ class KaaLoader(BaseSlimLoader):
         for k in kw:
             self.obj[k] = kw[k]
 
+loaders.append(KaaLoader)
+
 
 # Do our loading
 MutagenLoader.file_mapping = _loader({
@@ -142,3 +942,16 @@ MutagenLoader.file_mapping = _loader({
 KaaLoader.file_mapping = _loader({
         'mp3': 'kaa.metadata.audio.mp3.Parser', 
         'ogg': 'kaa.metadata.audio.ogg.Parser'})
+
+TagPyLoader.file_mapping = _loader({
+        'mp3': 'tagpy.FileRef', 
+        'flac': 'tagpy.FileRef', 
+        'ogg': 'tagpy.FileRef'})
+
+# Each type goes to the first loader that handles it, in a fixed order, so 
+# that load() gives the same keys wherever the same backends are installed. 
+# Writable loaders come first, so that what load() returns can be saved. 
+# benchmark() may swap in a faster loader that gives the same keys.
+for cls in sorted(loaders, key=lambda cls: not cls.writable):
+    for ext in cls.file_mapping:
+        ldict.setdefault(ext, cls)